@@ -0,0 +1,278 @@
+#
+# Benchmarks for micropython_ota, run on the host (CPython 3.10+) against the reference server (ota_server/ota_server.py) in a separate process.
+#
+# Commands:
+#  * update: Sweeps file count, file size, compression and basic authentication and runs one ota_update per combination on a fresh simulated device
+#    filesystem. Reports wall time, number of requests, bytes sent by the server, bytes written to flash and peak Python heap usage (tracemalloc).
+#  * fleet: Simulates a fleet of devices concurrently polling the version file with check_version_async and reports throughput and latency percentiles,
+#    for sizing the server. Each simulated device keeps its own conditional request state (ETag/Last-Modified) in memory.
+#
+# The MicroPython modules are replaced by CPython equivalents, as done by the tests. urequests is replaced by a minimal client based on http.client that
+# opens one connection per request. Memory figures are those of CPython (e.g. zlib always allocates a 32K window) and only indicate relative differences.
+#
+import argparse
+import asyncio
+import binascii
+import contextvars
+import hashlib
+import http.client
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from urllib.parse import urlsplit
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, 'ota_server'))
+sys.path.append(os.path.join(BASE_DIR, 'tests', 'mocks'))
+import deflate_mock
+import ota_server
+
+
+class UrequestsResponse:
+    def __init__(self, connection, response):
+        self.connection = connection
+        self.status_code = response.status
+        self.headers = dict(response.getheaders())
+        self.raw = response
+
+    @property
+    def text(self) -> str:
+        return self.raw.read().decode()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def urequests_get(url, headers=None, timeout=None) -> UrequestsResponse:
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+    connection.request('GET', parts.path, headers=headers or {})
+    return UrequestsResponse(connection, connection.getresponse())
+
+
+def install_shims() -> None:
+    machine = types.ModuleType('machine')
+    machine.reset = lambda: None
+    machine.soft_reset = lambda: None
+    machine.unique_id = lambda: b'\x24\x0a\xc4\x12\x34\x56'
+    urequests = types.ModuleType('urequests')
+    urequests.get = urequests_get
+    utime = types.ModuleType('utime')
+    utime.ticks_ms = lambda: int(time.monotonic() * 1000)
+    utime.ticks_add = lambda ticks, delta: ticks + delta
+    utime.ticks_diff = lambda ticks1, ticks2: ticks1 - ticks2
+    utime.time = time.time
+    utime.gmtime = time.gmtime
+    sys.modules.update({'machine': machine, 'urequests': urequests, 'utime': utime, 'uos': os, 'ubinascii': binascii, 'uhashlib': hashlib, 'ujson': json,
+                        'uasyncio': asyncio, 'usocket': socket, 'urandom': random, 'deflate': deflate_mock})
+
+
+install_shims()
+import micropython_ota
+import micropython_ota_async
+
+
+class FlashCounter:
+    def __init__(self):
+        self.bytes_written = 0
+
+    def open(self, filename, mode='r', *args, **kwargs):
+        return CountingFile(open(filename, mode, *args, **kwargs), self)
+
+
+class CountingFile:
+    def __init__(self, file, counter):
+        self.file = file
+        self.counter = counter
+
+    def write(self, data) -> int:
+        self.counter.bytes_written += len(data.encode() if isinstance(data, str) else data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+
+def run_server(root, user, passwd, connection) -> None:
+    with ota_server.OtaServer(root, port=0, user=user, passwd=passwd) as server:
+        connection.send(server.port)
+        while connection.recv() == 'stats':
+            connection.send((server.request_count, server.bytes_sent, server.statuses[304]))
+
+
+class ServerProcess:
+    def __init__(self, root, user=None, passwd=None):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=run_server, args=(root, user, passwd, child_connection), daemon=True)
+
+    def stats(self) -> (int, int, int):
+        self.connection.send('stats')
+        return self.connection.recv()
+
+    def __enter__(self):
+        self.process.start()
+        self.port = self.connection.recv()
+        return self
+
+    def __exit__(self, *args):
+        self.connection.send('stop')
+        self.process.join()
+
+
+def write_release(root, project, file_count, file_size, seed=0) -> list:
+    generator = random.Random(seed)
+    words = [''.join(generator.choice('abcdefghijklmnopqrstuvwxyz_') for _ in range(generator.randint(2, 10))) for _ in range(200)]
+    filenames = [f'lib/module_{index}.py' if index else 'main.py' for index in range(file_count)]
+    for version in ['v1.0.0', 'v1.0.1']:
+        for filename in filenames:
+            path = os.path.join(root, project, version, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            content = bytearray()
+            while len(content) < file_size:
+                content.extend(f'{generator.choice(words)} = {generator.choice(words)}({generator.randint(0, 999)})\n'.encode())
+            with open(path, 'wb') as release_file:
+                release_file.write(content[:file_size])
+    with open(os.path.join(root, project, 'version'), 'w') as version_file:
+        version_file.write('v1.0.1')
+    return filenames
+
+
+def benchmark_update(file_count, file_size, use_compression, use_auth, keep_alive=False, chunk_size=1024) -> dict:
+    user, passwd = ('ota', 'secret') if use_auth else (None, None)
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as device_dir:
+        filenames = write_release(root, 'bench', file_count, file_size)
+        with ServerProcess(root, user, passwd) as server:
+            os.chdir(device_dir)
+            counter = FlashCounter()
+            micropython_ota.open = counter.open
+            try:
+                tracemalloc.start()
+                started = time.perf_counter()
+                micropython_ota.ota_update(f'http://127.0.0.1:{server.port}', 'bench', filenames, user=user, passwd=passwd, hard_reset_device=False,
+                                           use_compression=use_compression, keep_alive=keep_alive, chunk_size=chunk_size)
+                wall_time = time.perf_counter() - started
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                with open('version', 'r') as version_file:
+                    updated = version_file.read() == 'v1.0.1'
+            finally:
+                del micropython_ota.open
+                os.chdir(working_dir)
+            requests, bytes_sent, _ = server.stats()
+    return {'files': file_count, 'size': file_size, 'compression': use_compression, 'auth': use_auth, 'updated': updated, 'wall_time': wall_time,
+            'requests': requests, 'bytes_sent': bytes_sent, 'flash_bytes': counter.bytes_written, 'peak_memory': peak_memory}
+
+
+device_validators = contextvars.ContextVar('device_validators')
+
+
+def read_device_validators(version_url) -> dict:
+    return device_validators.get().get(version_url, {})
+
+
+def write_device_validators(version_url, validators) -> None:
+    device_validators.get()[version_url] = validators
+
+
+async def poll_fleet(host, project, devices, rounds, concurrency) -> (list, int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def device():
+        nonlocal failures
+        device_validators.set({})
+        for _ in range(rounds):
+            async with semaphore:
+                started = time.perf_counter()
+                _, remote_version = await micropython_ota_async.check_version_async(host, project)
+                latencies.append(time.perf_counter() - started)
+                failures += remote_version != 'v1.0.1'
+
+    await asyncio.gather(*[device() for _ in range(devices)])
+    return latencies, failures
+
+
+def benchmark_fleet(devices, rounds, concurrency) -> dict:
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as device_dir:
+        write_release(root, 'bench', 1, 1024)
+        with ServerProcess(root) as server:
+            os.chdir(device_dir)
+            validators_functions = micropython_ota_async._read_version_validators, micropython_ota_async._write_version_validators
+            micropython_ota_async._read_version_validators, micropython_ota_async._write_version_validators = read_device_validators, write_device_validators
+            try:
+                started = time.perf_counter()
+                latencies, failures = asyncio.run(poll_fleet(f'http://127.0.0.1:{server.port}', 'bench', devices, rounds, concurrency))
+                wall_time = time.perf_counter() - started
+            finally:
+                micropython_ota_async._read_version_validators, micropython_ota_async._write_version_validators = validators_functions
+                os.chdir(working_dir)
+            requests, bytes_sent, not_modified = server.stats()
+    latencies.sort()
+    return {'devices': devices, 'rounds': rounds, 'concurrency': concurrency, 'failures': failures, 'wall_time': wall_time, 'requests': requests,
+            'not_modified': not_modified, 'requests_per_second': requests / wall_time, 'bytes_sent': bytes_sent, 'latency_p50': latencies[len(latencies) // 2],
+            'latency_p95': latencies[int(len(latencies) * 0.95)], 'latency_max': latencies[-1]}
+
+
+def print_table(results) -> None:
+    columns = list(results[0])
+    rows = [[f'{value:.4f}' if isinstance(value, float) else str(value) for value in result.values()] for result in results]
+    widths = [max(len(column), *[len(row[index]) for row in rows]) for index, column in enumerate(columns)]
+    print('  '.join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+def parse_int_list(value) -> list:
+    return [int(item) for item in value.split(',')]
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmark micropython_ota against the reference server')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON instead of a table')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update_parser = commands.add_parser('update', help='benchmark ota_update for combinations of file count, file size, compression and authentication')
+    update_parser.add_argument('--files', type=parse_int_list, default=[1, 10], help='comma-separated file counts')
+    update_parser.add_argument('--sizes', type=parse_int_list, default=[1024, 32768], help='comma-separated file sizes in bytes')
+    update_parser.add_argument('--chunk-size', type=int, default=1024, help='chunk_size passed to ota_update')
+    update_parser.add_argument('--keep-alive', action='store_true', help='use a persistent connection (keep_alive=True)')
+
+    fleet_parser = commands.add_parser('fleet', help='simulate a fleet of devices polling the version file')
+    fleet_parser.add_argument('--devices', type=int, default=1000, help='number of simulated devices')
+    fleet_parser.add_argument('--rounds', type=int, default=1, help='number of polls per device')
+    fleet_parser.add_argument('--concurrency', type=int, default=256, help='maximum number of simultaneously open connections')
+
+    args = parser.parse_args(argv)
+    if args.command == 'update':
+        benchmark_update(1, 1024, True, True, args.keep_alive, args.chunk_size)
+        results = [benchmark_update(file_count, file_size, use_compression, use_auth, args.keep_alive, args.chunk_size)
+                   for file_count, file_size, use_compression, use_auth in itertools.product(args.files, args.sizes, [False, True], [False, True])]
+    else:
+        results = [benchmark_fleet(args.devices, args.rounds, args.concurrency)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == '__main__':
+    main()
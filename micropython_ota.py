@@ -1,33 +1,332 @@
 import machine
+import sys
 import ubinascii
+import uhashlib
+import ujson
 import uos
 import urequests
+import utime
 
+_GZIP_WBITS = 12
+_TAR_BLOCK_SIZE = 512
+_PATCH_MAGIC = b'OTAP\x01'
+_CLOCK_SET_AFTER = 1672531200
+_MIRROR_RANKING_INTERVAL = 20
 
-def check_version(host, project, auth=None, timeout=5) -> (bool, str):
-    current_version = ''
+
+def _emit(observer, event, data) -> None:
+    if observer:
+        observer(event, data)
+
+
+def _log(observer, message) -> None:
+    if observer:
+        observer('log', {'message': message})
+    else:
+        print(message)
+
+
+def _get_header(response, name) -> str | None:
+    headers = getattr(response, 'headers', None) or {}
+    for key in headers:
+        if key.lower() == name.lower():
+            return headers[key]
+    return None
+
+
+class _UrequestsSession:
+    def __init__(self, auth=None, timeout=5):
+        self.auth = auth
+        self.timeout = timeout
+
+    def get(self, url, headers=None):
+        headers = dict(headers) if headers else {}
+        if self.auth:
+            headers['Authorization'] = f'Basic {self.auth}'
+        if headers:
+            return urequests.get(url, headers=headers, timeout=self.timeout)
+        return urequests.get(url, timeout=self.timeout)
+
+    def close(self) -> None:
+        pass
+
+
+def _read_all_version_validators() -> dict:
     try:
-        if 'version' in uos.listdir():
-            with open('version', 'r') as current_version_file:
-                current_version = current_version_file.readline().strip()
+        with open('version_validators', 'r') as validators_file:
+            return ujson.load(validators_file)
+    except (OSError, ValueError):
+        return {}
 
-        if auth:
-            response = urequests.get(f'{host}/{project}/version', headers={'Authorization': f'Basic {auth}'}, timeout=timeout)
-        else:
-            response = urequests.get(f'{host}/{project}/version', timeout=timeout)
+
+def _read_version_validators(version_url) -> dict:
+    return _read_all_version_validators().get(version_url, {})
+
+
+def _write_version_validators(version_url, validators) -> None:
+    all_validators = _read_all_version_validators()
+    if validators == all_validators.get(version_url):
+        return
+    if validators.get('etag') or validators.get('last_modified'):
+        all_validators[version_url] = validators
+    elif all_validators.pop(version_url, None) is None:
+        return
+    if all_validators:
+        with open('version_validators', 'w') as validators_file:
+            ujson.dump(all_validators, validators_file)
+    else:
+        _remove_file('version_validators')
+
+
+def _read_last_check() -> dict:
+    try:
+        with open('last_check', 'r') as last_check_file:
+            return ujson.load(last_check_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_last_check(last_check) -> None:
+    with open('last_check', 'w') as last_check_file:
+        ujson.dump(last_check, last_check_file)
+
+
+def _mark_update_pending(remote_version) -> None:
+    last_check = _read_last_check()
+    if not last_check.get('pending') or last_check.get('version') != remote_version:
+        last_check.update({'version': remote_version, 'pending': True})
+        _write_last_check(last_check)
+
+
+def _record_check(remote_version) -> None:
+    now = _unix_time()
+    if now >= _CLOCK_SET_AFTER:
+        _write_last_check({'time': now, 'version': remote_version, 'pending': False})
+    else:
+        _remove_file('last_check')
+
+
+def _is_check_cached(check_ttl) -> bool:
+    if not check_ttl:
+        return False
+    last_check = _read_last_check()
+    if last_check.get('pending') or 'time' not in last_check:
+        return False
+    now = _unix_time()
+    return now >= _CLOCK_SET_AFTER and 0 <= now - last_check['time'] < check_ttl
+
+
+def _read_current_version() -> str:
+    if 'version' in uos.listdir():
+        with open('version', 'r') as current_version_file:
+            return current_version_file.readline().strip()
+    return ''
+
+
+def _conditional_headers(validators) -> dict:
+    conditional_headers = {}
+    if validators.get('etag'):
+        conditional_headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        conditional_headers['If-Modified-Since'] = validators['last_modified']
+    return conditional_headers
+
+
+def _unix_time() -> int:
+    return utime.time() + (946684800 if utime.gmtime(0)[0] == 2000 else 0)
+
+
+def _rollout_position() -> float:
+    digest = uhashlib.sha256(machine.unique_id()).digest()
+    return (digest[0] << 8 | digest[1]) / 65536
+
+
+def _is_rolled_out(attributes) -> bool:
+    percentage = attributes.get('rollout')
+    window = attributes.get('rollout_window')
+    if percentage is None and window is None:
+        return True
+    position = _rollout_position()
+    if percentage is not None and position * 100 >= float(percentage):
+        return False
+    if window is not None and attributes.get('rollout_start') is not None:
+        now = _unix_time()
+        if now >= _CLOCK_SET_AFTER and now < int(attributes['rollout_start']) + position * int(window):
+            return False
+    return True
+
+
+def _is_new_version(current_version, remote_version, attributes=None, observer=None, use_slots=True) -> bool:
+    if current_version == remote_version or (use_slots and _read_slot_state().get('failed_version') == remote_version):
+        return False
+    if attributes and not _is_rolled_out(attributes):
+        _log(observer, f'Version {remote_version} is not rolled out to this device yet')
+        return False
+    return True
+
+
+def _parse_version_file(text) -> (str, dict):
+    lines = text.strip().split('\n')
+    attributes = {}
+    for line in lines[1:]:
+        name, separator, value = line.partition('=')
+        if separator:
+            attributes[name.strip()] = value.strip()
+    return lines[0].strip(), attributes
+
+
+def _get_retry_after(response) -> int | None:
+    retry_after = _get_header(response, 'Retry-After')
+    if retry_after and retry_after.strip().isdigit():
+        return int(retry_after)
+    return None
+
+
+def _get_max_age(response) -> int | None:
+    retry_after = _get_retry_after(response)
+    if retry_after is not None:
+        return retry_after
+    for directive in (_get_header(response, 'Cache-Control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name.lower() == 'max-age' and value.isdigit():
+            return int(value)
+    return None
+
+
+def check_version(host, project, auth=None, timeout=5, session=None, details=None, observer=None) -> (bool, str):
+    details = {} if details is None else details
+    started = utime.ticks_ms()
+    version_changed, remote_version = _check_version(host, project, auth, timeout, session, details, observer)
+    details['duration_ms'] = utime.ticks_diff(utime.ticks_ms(), started)
+    _emit(observer, 'version_check', {'host': host, 'status': details.get('status'), 'duration_ms': details['duration_ms'], 'version': remote_version,
+                                      'changed': version_changed})
+    return version_changed, remote_version
+
+
+def _check_version(host, project, auth, timeout, session, details, observer) -> (bool, str):
+    current_version = ''
+    try:
+        current_version = _read_current_version()
+        version_url = f'{host}/{project}/version'
+        validators = _read_version_validators(version_url)
+        session = session or _UrequestsSession(auth, timeout)
+        response = session.get(version_url, _conditional_headers(validators))
         response_status_code = response.status_code
+        details['status'] = response_status_code
+        details['max_age'] = _get_max_age(response)
+        details['retry_after'] = _get_retry_after(response)
+        if response_status_code == 304 and validators.get('version'):
+            response.close()
+            details['attributes'] = validators.get('attributes', {})
+            return _is_new_version(current_version, validators['version'], details['attributes'], observer), validators['version']
         response_text = response.text
+        etag = _get_header(response, 'ETag')
+        last_modified = _get_header(response, 'Last-Modified')
         response.close()
         if response_status_code != 200:
-            print(f'Remote version file {host}/{project}/version not found')
+            _log(observer, f'Remote version file {host}/{project}/version not found')
             return False, current_version
-        remote_version = response_text.strip()
-        return current_version != remote_version, remote_version
+        remote_version, details['attributes'] = _parse_version_file(response_text)
+        _write_version_validators(version_url, {'version': remote_version, 'etag': etag, 'last_modified': last_modified, 'attributes': details['attributes']})
+        return _is_new_version(current_version, remote_version, details['attributes'], observer), remote_version
     except Exception as ex:
-        print(f'Something went wrong: {ex}')
+        details['status'] = None
+        _log(observer, f'Something went wrong: {ex}')
         return False, current_version
 
 
+def _mirror_list(host) -> list:
+    return [host] if isinstance(host, str) else list(host)
+
+
+def _read_mirror_state() -> dict:
+    try:
+        with open('mirrors.json', 'r') as mirrors_file:
+            return ujson.load(mirrors_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _rank_mirrors(hosts, mirror_state=None) -> list:
+    ranking = (_read_mirror_state() if mirror_state is None else mirror_state).get('ranking', [])
+    return [mirror for mirror in ranking if mirror in hosts] + [mirror for mirror in hosts if mirror not in ranking]
+
+
+def _write_mirror_state(ranking, checks) -> None:
+    mirror_state = {'ranking': ranking, 'checks': checks}
+    if mirror_state != _read_mirror_state():
+        with open('mirrors.json', 'w') as mirrors_file:
+            ujson.dump(mirror_state, mirrors_file)
+
+
+class _MirrorSessions:
+    def __init__(self, auth, timeout, keep_alive=False):
+        self.auth = auth
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.sessions = {}
+
+    def get(self, host):
+        if host not in self.sessions:
+            if self.keep_alive:
+                from micropython_ota_http import HttpSession
+                self.sessions[host] = HttpSession(host, self.auth, self.timeout)
+            else:
+                self.sessions[host] = _UrequestsSession(self.auth, self.timeout)
+        return self.sessions[host]
+
+    def close(self) -> None:
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
+
+
+def _check_ranked_mirrors(ranking, project, auth, timeout, sessions, details, observer) -> (bool, str, list):
+    for index, mirror in enumerate(ranking):
+        session = sessions.get(mirror) if sessions else None
+        version_changed, remote_version = check_version(mirror, project, auth=auth, timeout=timeout, session=session, details=details, observer=observer)
+        if details.get('status') in (200, 304):
+            return version_changed, remote_version, ranking[index:] + ranking[:index]
+    return False, _read_current_version(), ranking
+
+
+def _check_mirrors(hosts, project, auth=None, timeout=5, sessions=None, observer=None, details=None) -> (bool, str, list):
+    details = {} if details is None else details
+    sessions = sessions or _MirrorSessions(auth, timeout)
+    mirror_state = _read_mirror_state()
+    if mirror_state.get('ranking') and mirror_state.get('checks', 0) < _MIRROR_RANKING_INTERVAL:
+        version_changed, remote_version, ranking = _check_ranked_mirrors(_rank_mirrors(hosts, mirror_state), project, auth, timeout, sessions, details,
+                                                                         observer)
+        _write_mirror_state(ranking, mirror_state.get('checks', 0) + 1)
+        return version_changed, remote_version, ranking
+    healthy = []
+    unhealthy = []
+    for mirror in _rank_mirrors(hosts):
+        mirror_details = {}
+        started = utime.ticks_ms()
+        result = check_version(mirror, project, auth=auth, timeout=timeout, session=sessions.get(mirror), details=mirror_details, observer=observer)
+        if mirror_details.get('status') in (200, 304):
+            healthy.append((utime.ticks_diff(utime.ticks_ms(), started), mirror, result, mirror_details))
+        else:
+            unhealthy.append(mirror)
+    healthy.sort(key=lambda entry: entry[0])
+    ranking = [entry[1] for entry in healthy] + unhealthy
+    _write_mirror_state(ranking, 0)
+    if not healthy:
+        return False, _read_current_version(), ranking
+    version_changed, remote_version = healthy[0][2]
+    details.update(healthy[0][3])
+    return version_changed, remote_version, ranking
+
+
+def _check_preferred_mirror(hosts, project, auth=None, timeout=5, details=None, observer=None) -> (bool, str):
+    details = {} if details is None else details
+    mirror_state = _read_mirror_state()
+    version_changed, remote_version, ranking = _check_ranked_mirrors(_rank_mirrors(hosts, mirror_state), project, auth, timeout, None, details, observer)
+    _write_mirror_state(ranking, mirror_state.get('checks', _MIRROR_RANKING_INTERVAL))
+    return version_changed, remote_version
+
+
 def generate_auth(user=None, passwd=None) -> str | None:
     if not user and not passwd:
         return None
@@ -37,59 +336,822 @@ def generate_auth(user=None, passwd=None) -> str | None:
     return auth_bytes.decode().strip()
 
 
-def ota_update(host, project, filenames, use_version_prefix=True, user=None, passwd=None, hard_reset_device=True, soft_reset_device=False, timeout=5) -> None:
+def _file_exists(filename) -> bool:
+    try:
+        uos.stat(filename)
+        return True
+    except OSError:
+        return False
+
+
+def _remove_file(filename) -> None:
+    try:
+        uos.remove(filename)
+    except OSError:
+        pass
+
+
+def _makedirs(filename) -> None:
+    path = ''
+    for directory in filename.split('/')[:-1]:
+        path = f'{path}/{directory}' if path else directory
+        try:
+            uos.mkdir(path)
+        except OSError:
+            pass
+
+
+def _file_size(filename) -> int:
+    try:
+        return uos.stat(filename)[6]
+    except OSError:
+        return 0
+
+
+def _remove_tree(path) -> None:
+    try:
+        entries = uos.listdir(path)
+    except OSError:
+        return
+    for name in entries:
+        entry_path = f'{path}/{name}'
+        if uos.stat(entry_path)[0] & 0x4000:
+            _remove_tree(entry_path)
+        else:
+            uos.remove(entry_path)
+    uos.rmdir(path)
+
+
+def _read_journal() -> dict:
+    try:
+        with open('tmp/journal', 'r') as journal_file:
+            return ujson.load(journal_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_journal(journal) -> None:
+    with open('tmp/journal', 'w') as journal_file:
+        ujson.dump(journal, journal_file)
+
+
+def _gzip_stream(stream):
+    try:
+        import deflate
+        return deflate.DeflateIO(stream, deflate.GZIP, _GZIP_WBITS)
+    except ImportError:
+        import uzlib
+        return uzlib.DecompIO(stream, 16 + _GZIP_WBITS)
+
+
+def _read_exactly(stream, buffer_view) -> int:
+    bytes_total = 0
+    while bytes_total < len(buffer_view):
+        bytes_read = stream.readinto(buffer_view[bytes_total:])
+        if not bytes_read:
+            break
+        bytes_total += bytes_read
+    return bytes_total
+
+
+def _tar_field(field) -> str:
+    end = field.find(b'\0')
+    return (field if end < 0 else field[:end]).decode().strip()
+
+
+def _extract_tar(stream, target_dir, buffer, digests=None) -> list:
+    header = bytearray(_TAR_BLOCK_SIZE)
+    header_view = memoryview(header)
+    buffer_view = memoryview(buffer)
+    filenames = []
+    while _read_exactly(stream, header_view) == _TAR_BLOCK_SIZE and header[0]:
+        filename = _tar_field(header[0:100])
+        if header[257:262] == b'ustar' and header[345]:
+            filename = f'{_tar_field(header[345:500])}/{filename}'
+        filename = filename[2:] if filename.startswith('./') else filename
+        remaining = int(_tar_field(header[124:136]) or '0', 8)
+        padding = -remaining % _TAR_BLOCK_SIZE
+        target_file = None
+        digest = None
+        if header[156] in (0, ord('0')) and filename:
+            if filename.startswith('/') or '..' in filename.split('/'):
+                raise ValueError(f'Invalid bundle member name {filename}')
+            if digests is not None and not digests.get(filename):
+                raise ValueError(f'Bundle member {filename} is not listed in the manifest')
+            _makedirs(f'{target_dir}/{filename}')
+            target_file = open(f'{target_dir}/{filename}', 'wb')
+            filenames.append(filename)
+            if digests is not None:
+                digest = uhashlib.sha256()
+        try:
+            remaining += padding
+            while remaining:
+                bytes_read = _read_exactly(stream, buffer_view[:min(remaining, len(buffer))])
+                if not bytes_read:
+                    raise OSError('Unexpected end of archive')
+                if target_file and remaining > padding:
+                    target_file.write(buffer_view[:min(bytes_read, remaining - padding)])
+                    if digest:
+                        digest.update(buffer_view[:min(bytes_read, remaining - padding)])
+                remaining -= bytes_read
+        finally:
+            if target_file:
+                target_file.close()
+        if digest:
+            _verify_digest(f'{target_dir}/{filename}', digest, digests[filename])
+    return filenames
+
+
+def _download_bundle(session, host, project, remote_version, bundle, buffer, digests=None, stats=None, required_filenames=None) -> list | None:
+    stats = {} if stats is None else stats
+    response = session.get(f'{host}/{project}/{remote_version}.{bundle}')
+    try:
+        stats['status'] = response.status_code
+        if response.status_code != 200:
+            return None
+        stream = _gzip_stream(response.raw) if bundle.endswith('.gz') else response.raw
+        filenames = _extract_tar(stream, 'tmp', buffer, digests)
+        missing_filenames = [filename for filename in required_filenames or [] if filename not in filenames]
+        if missing_filenames:
+            raise ValueError(f'Bundle is missing {", ".join(missing_filenames)}')
+        stats['bytes'] = sum(_file_size(f'tmp/{filename}') for filename in filenames)
+        return filenames
+    finally:
+        response.close()
+
+
+def _get_manifest(session, host, project, remote_version, prefix_or_path_separator) -> dict | None:
+    response = session.get(f'{host}/{project}/{remote_version}{prefix_or_path_separator}manifest.json')
+    response_status_code = response.status_code
+    response_text = response.text
+    response.close()
+    if response_status_code != 200:
+        return None
+    return ujson.loads(response_text)['files']
+
+
+def _read_local_manifest() -> dict:
+    try:
+        with open('manifest.json', 'r') as manifest_file:
+            return ujson.load(manifest_file)['files']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _replace_file(source_filename, target_filename) -> None:
+    try:
+        uos.rename(source_filename, target_filename)
+    except OSError:
+        uos.remove(target_filename)
+        uos.rename(source_filename, target_filename)
+
+
+def _read_slot_state() -> dict:
+    try:
+        with open('slots.json', 'r') as slot_state_file:
+            return ujson.load(slot_state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_slot_state(slot_state) -> None:
+    with open('slots.json.new', 'w') as slot_state_file:
+        ujson.dump(slot_state, slot_state_file)
+    _replace_file('slots.json.new', 'slots.json')
+
+
+def _inactive_slot(slot_state) -> str:
+    return 'slot_b' if slot_state.get('active') == 'slot_a' else 'slot_a'
+
+
+def activate_slot(max_boot_attempts=3) -> str | None:
+    slot_state = _read_slot_state()
+    if not slot_state.get('active'):
+        return None
+    if slot_state.get('pending'):
+        if slot_state['boot_attempts'] >= max_boot_attempts and slot_state.get('previous'):
+            failed_slot = slot_state['active']
+            print(f'{failed_slot} was not marked healthy within {max_boot_attempts} boots, rolling back to {slot_state["previous"]}')
+            slot_state['failed_version'] = slot_state['versions'].get(failed_slot)
+            slot_state['active'] = slot_state['previous']
+            slot_state['previous'] = None
+            slot_state['pending'] = False
+            with open('version', 'w') as current_version_file:
+                current_version_file.write(slot_state['versions'].get(slot_state['active'], ''))
+            _remove_file('manifest.json')
+        else:
+            slot_state['boot_attempts'] += 1
+        _write_slot_state(slot_state)
+    if slot_state['active'] not in sys.path:
+        sys.path.insert(0, slot_state['active'])
+    return slot_state['active']
+
+
+def mark_healthy() -> None:
+    slot_state = _read_slot_state()
+    if slot_state.get('pending'):
+        slot_state['pending'] = False
+        slot_state['boot_attempts'] = 0
+        _write_slot_state(slot_state)
+
+
+def _commit(journal) -> None:
+    slot = journal.get('slot')
+    for filename in journal['files']:
+        target_filename = f'{slot}/{filename}' if slot else filename
+        if _file_exists(f'tmp/{filename}'):
+            _makedirs(target_filename)
+            _replace_file(f'tmp/{filename}', target_filename)
+    if not slot:
+        for filename in journal['removed']:
+            _remove_file(filename)
+    if journal.get('projects') is not None:
+        projects_state = _read_projects_state()
+        projects_state.update(journal['projects'])
+        with open('projects.json', 'w') as projects_file:
+            ujson.dump(projects_state, projects_file)
+        _remove_tree('tmp')
+        return
+    if journal.get('manifest') is not None:
+        with open('manifest.json', 'w') as manifest_file:
+            ujson.dump({'files': journal['manifest']}, manifest_file)
+    else:
+        _remove_file('manifest.json')
+    if slot:
+        slot_state = _read_slot_state()
+        if slot_state.get('active') != slot:
+            versions = slot_state.get('versions', {})
+            versions[slot] = journal['version']
+            _write_slot_state({'active': slot, 'previous': journal.get('previous_slot'), 'pending': True, 'boot_attempts': 0, 'versions': versions})
+    with open('version', 'w') as current_version_file:
+        current_version_file.write(journal['version'])
+    _remove_tree('tmp')
+
+
+def _verify_digest(filename, digest, expected_sha256) -> None:
+    if ubinascii.hexlify(digest.digest()).decode() != expected_sha256.lower():
+        _remove_file(filename)
+        raise ValueError(f'Checksum mismatch for {filename}')
+
+
+def _update_digest(filename, digest, buffer) -> None:
+    buffer_view = memoryview(buffer)
+    with open(filename, 'rb') as source_file:
+        while True:
+            bytes_read = source_file.readinto(buffer)
+            if not bytes_read:
+                break
+            digest.update(buffer_view[:bytes_read])
+
+
+def _get_sidecar_sha256(session, file_url) -> str | None:
+    response = session.get(f'{file_url}.sha256')
+    response_status_code = response.status_code
+    response_text = response.text
+    response.close()
+    if response_status_code != 200:
+        return None
+    return response_text.split()[0]
+
+
+def _stream_to_file(stream, filename, buffer, mode='wb', digest=None, progress=None) -> int:
+    buffer_view = memoryview(buffer)
+    bytes_written = 0
+    with open(filename, mode) as target_file:
+        while True:
+            bytes_read = stream.readinto(buffer)
+            if not bytes_read:
+                break
+            target_file.write(buffer_view[:bytes_read])
+            if digest:
+                digest.update(buffer_view[:bytes_read])
+            bytes_written += bytes_read
+            if progress:
+                progress(bytes_written)
+    return bytes_written
+
+
+def _copy_file(source_filename, target_filename, buffer) -> None:
+    buffer_view = memoryview(buffer)
+    with open(source_filename, 'rb') as source_file, open(target_filename, 'wb') as target_file:
+        while True:
+            bytes_read = source_file.readinto(buffer)
+            if not bytes_read:
+                break
+            target_file.write(buffer_view[:bytes_read])
+
+
+def _expected_file_size(response) -> int | None:
+    try:
+        if response.status_code == 206:
+            byte_range, _, total = (_get_header(response, 'Content-Range') or '').partition('/')
+            return int(total) if total.strip() not in ('', '*') else int(byte_range.split('-')[1]) + 1
+        content_length = _get_header(response, 'Content-Length')
+        return int(content_length) if content_length is not None else None
+    except (ValueError, IndexError):
+        return None
+
+
+def _download_file(session, file_url, target_filename, buffer, use_compression=False, expected_sha256=None, stats=None, progress=None) -> bool:
+    stats = {} if stats is None else stats
+    response = session.get(f'{file_url}.gz') if use_compression else None
+    compressed = response is not None and response.status_code == 200
+    if not compressed:
+        if response is not None:
+            response.close()
+        offset = _file_size(target_filename)
+        response = session.get(file_url, {'Range': f'bytes={offset}-'} if offset else None)
+        if response.status_code == 416:
+            response.close()
+            response = session.get(file_url)
+    try:
+        stats['status'] = response.status_code
+        if response.status_code not in (200, 206):
+            return False
+        if (_get_header(response, 'Content-Encoding') or '').lower() == 'gzip':
+            compressed = True
+        _makedirs(target_filename)
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        digest = uhashlib.sha256() if expected_sha256 else None
+        if digest and mode == 'ab':
+            _update_digest(target_filename, digest, buffer)
+        stats['resumed_from'] = offset if mode == 'ab' else 0
+        stats['bytes'] = _stream_to_file(_gzip_stream(response.raw) if compressed else response.raw, target_filename, buffer, mode, digest, progress)
+        expected_size = None if compressed else _expected_file_size(response)
+        if expected_size is not None and _file_size(target_filename) != expected_size:
+            raise OSError(f'Incomplete download, received {_file_size(target_filename)} of {expected_size} bytes')
+        if digest:
+            _verify_digest(target_filename, digest, expected_sha256)
+        return True
+    finally:
+        response.close()
+
+
+def _apply_patch(stream, old_filename, target_filename, buffer, digest=None) -> None:
+    header = bytearray(8)
+    header_view = memoryview(header)
+    buffer_view = memoryview(buffer)
+    if _read_exactly(stream, header_view[:5]) != 5 or header[:5] != _PATCH_MAGIC:
+        raise ValueError(f'Invalid patch for {target_filename}')
+    with open(old_filename, 'rb') as old_file, open(target_filename, 'wb') as target_file:
+        while True:
+            if _read_exactly(stream, header_view[:1]) != 1:
+                raise OSError('Unexpected end of patch')
+            operation = header[0]
+            if operation == ord('E'):
+                return
+            if operation == ord('C'):
+                if _read_exactly(stream, header_view) != 8:
+                    raise OSError('Unexpected end of patch')
+                old_file.seek(int.from_bytes(header[0:4], 'big'))
+                remaining = int.from_bytes(header[4:8], 'big')
+                source = old_file
+            elif operation == ord('I'):
+                if _read_exactly(stream, header_view[:4]) != 4:
+                    raise OSError('Unexpected end of patch')
+                remaining = int.from_bytes(header[0:4], 'big')
+                source = stream
+            else:
+                raise ValueError(f'Invalid patch operation {operation} for {target_filename}')
+            while remaining:
+                bytes_read = _read_exactly(source, buffer_view[:min(remaining, len(buffer))])
+                if not bytes_read:
+                    raise OSError('Unexpected end of patch')
+                target_file.write(buffer_view[:bytes_read])
+                if digest:
+                    digest.update(buffer_view[:bytes_read])
+                remaining -= bytes_read
+
+
+def _download_patch(session, patch_url, old_filename, target_filename, buffer, expected_sha256=None, stats=None, observer=None) -> bool:
+    stats = {} if stats is None else stats
+    response = session.get(patch_url)
+    try:
+        stats['status'] = response.status_code
+        if response.status_code != 200:
+            return False
+        digest = uhashlib.sha256() if expected_sha256 else None
+        _apply_patch(response.raw, old_filename, target_filename, buffer, digest)
+        if digest:
+            _verify_digest(target_filename, digest, expected_sha256)
+        stats['bytes'] = _file_size(target_filename)
+        return True
+    except (OSError, ValueError) as ex:
+        _log(observer, f'Applying patch {patch_url} failed: {ex}')
+        _remove_file(target_filename)
+        return False
+    finally:
+        response.close()
+
+
+def _finish_download(observer, result, filename, stats, downloaded, started) -> None:
+    stats['ok'] = downloaded
+    stats['duration_ms'] = utime.ticks_diff(utime.ticks_ms(), started)
+    result['files'][filename] = stats
+    result['bytes'] += stats['bytes']
+    event = {'filename': filename}
+    event.update(stats)
+    _emit(observer, 'download_end', event)
+
+
+def _complete_interrupted_commit(observer=None) -> None:
+    journal = _read_journal()
+    if journal.get('commit'):
+        _log(observer, f'Completing interrupted installation of version {journal["version"]}')
+        _commit(journal)
+
+
+def _start_journal(version) -> dict:
+    try:
+        uos.mkdir('tmp')
+    except:
+        pass
+    journal = _read_journal()
+    if journal.get('version') != version:
+        _remove_tree('tmp')
+        uos.mkdir('tmp')
+        journal = {'version': version, 'done': []}
+        _write_journal(journal)
+    return journal
+
+
+def _download_files(filenames, journal, sources, project, remote_version, manifest, buffer, result, observer, use_compression=False, verify_hash=False,
+                    use_patches=False, current_version='', installed_dir='', extra_stats=None) -> bool:
+    all_files_found = True
+    for filename in filenames:
+        if filename in journal['done']:
+            continue
+        installed_filename = f'{installed_dir}/{filename}' if installed_dir else filename
+        download_started = utime.ticks_ms()
+        stats = {'status': None, 'bytes': 0, 'retries': 0, 'patched': False, 'mirror': None}
+        if extra_stats:
+            stats.update(extra_stats)
+        progress = (lambda bytes_written: observer('download_progress', {'filename': filename, 'bytes': bytes_written})) if observer else None
+        downloaded = False
+        for attempt, (mirror, session, separator, from_peer) in enumerate(sources):
+            stats.update({'status': None, 'retries': attempt, 'mirror': mirror})
+            _emit(observer, 'download_start', {'filename': filename, 'mirror': mirror, 'attempt': attempt})
+            file_url = f'{mirror}/{project}/{remote_version}{separator}{filename}'
+            try:
+                if manifest is not None:
+                    expected_sha256 = manifest[filename].get('sha256')
+                else:
+                    expected_sha256 = _get_sidecar_sha256(session, file_url) if verify_hash else None
+                if from_peer and not expected_sha256:
+                    continue
+                if verify_hash and not expected_sha256:
+                    _log(observer, f'Remote checksum file {file_url}.sha256 not found')
+                    continue
+                if use_patches and expected_sha256 and not from_peer and current_version and _file_exists(installed_filename) and \
+                        _download_patch(session, f'{file_url}.{current_version}.patch', installed_filename, f'tmp/{filename}', buffer, expected_sha256, stats,
+                                        observer):
+                    stats['patched'] = True
+                    downloaded = True
+                    break
+                if _download_file(session, file_url, f'tmp/{filename}', buffer, use_compression and not from_peer, expected_sha256, stats, progress):
+                    downloaded = True
+                    break
+                _log(observer, f'Remote source file {file_url} not found')
+            except (OSError, ValueError) as ex:
+                _log(observer, f'Downloading {file_url} failed: {ex}')
+                if from_peer:
+                    _remove_file(f'tmp/{filename}')
+        _finish_download(observer, result, filename, stats, downloaded, download_started)
+        if not downloaded:
+            all_files_found = False
+            continue
+        journal['done'].append(filename)
+        _write_journal(journal)
+    return all_files_found
+
+
+def _commit_update(journal, result, observer) -> None:
+    commit_started = utime.ticks_ms()
+    journal['commit'] = True
+    _write_journal(journal)
+    _commit(journal)
+    result['updated'] = True
+    _emit(observer, 'commit', {'version': journal['version'], 'files': len(journal['files']), 'removed': len(journal['removed']),
+                               'duration_ms': utime.ticks_diff(utime.ticks_ms(), commit_started)})
+
+
+def _reset_after_update(result, started, hard_reset_device, soft_reset_device, observer) -> None:
+    if soft_reset_device or hard_reset_device:
+        result['duration_ms'] = utime.ticks_diff(utime.ticks_ms(), started)
+        _emit(observer, 'reset', {'soft': soft_reset_device, 'result': result})
+    if soft_reset_device:
+        _log(observer, 'Soft-resetting device...')
+        machine.soft_reset()
+    if hard_reset_device:
+        _log(observer, 'Hard-resetting device...')
+        machine.reset()
+
+
+def ota_update(host, project, filenames, use_version_prefix=True, user=None, passwd=None, hard_reset_device=True, soft_reset_device=False, timeout=5,
+               chunk_size=1024, use_manifest=False, bundle=None, use_compression=False, use_slots=False, keep_alive=False,
+               verify_hash=False, use_patches=False, observer=None, check_ttl=0, peer=None) -> dict:
+    started = utime.ticks_ms()
+    result = {'current_version': None, 'remote_version': None, 'updated': False, 'check_skipped': False, 'files': {}, 'bytes': 0, 'duration_ms': 0,
+              'error': None}
     all_files_found = True
     auth = generate_auth(user, passwd)
     prefix_or_path_separator = '_' if use_version_prefix else '/'
+    buffer = bytearray(chunk_size)
+    hosts = _mirror_list(host)
+    sessions = _MirrorSessions(auth, timeout, keep_alive)
+    peer_sessions = _MirrorSessions(peer.auth if peer is not None else None, timeout)
+    details = {}
     try:
-        version_changed, remote_version = check_version(host, project, auth=auth, timeout=timeout)
+        if peer is not None and auth and not peer.auth:
+            raise ValueError('Peers must require authentication when updating with credentials')
+        _complete_interrupted_commit(observer)
+        current_version = _read_current_version()
+        result['current_version'] = current_version
+        if _is_check_cached(check_ttl):
+            _log(observer, f'Skipping version check, last check was less than {check_ttl}s ago')
+            result['check_skipped'] = True
+            version_changed, remote_version = False, current_version
+        elif len(hosts) > 1:
+            version_changed, remote_version, hosts = _check_mirrors(hosts, project, auth=auth, timeout=timeout, sessions=sessions, observer=observer,
+                                                                    details=details)
+        else:
+            version_changed, remote_version = check_version(hosts[0], project, auth=auth, timeout=timeout, session=sessions.get(hosts[0]), details=details,
+                                                            observer=observer)
+        result['remote_version'] = remote_version
+        if check_ttl and details.get('status') in (200, 304) and not version_changed:
+            _record_check(remote_version)
         if version_changed:
-            try:
-                uos.mkdir('tmp')
-            except:
-                pass
-            for filename in filenames:
-                if auth:
-                    response = urequests.get(f'{host}/{project}/{remote_version}{prefix_or_path_separator}{filename}', headers={'Authorization': f'Basic {auth}'}, timeout=timeout)
+            slot_state = _read_slot_state() if use_slots else {}
+            installed_dir = slot_state.get('active') if use_slots else ''
+            manifest = None
+            if use_manifest:
+                for mirror in hosts:
+                    manifest = _get_manifest(sessions.get(mirror), mirror, project, remote_version, prefix_or_path_separator)
+                    if manifest is not None:
+                        break
                 else:
-                    response = urequests.get(f'{host}/{project}/{remote_version}{prefix_or_path_separator}{filename}', timeout=timeout)
-                response_status_code = response.status_code
-                response_text = response.text
-                response.close()
-                if response_status_code != 200:
-                    print(f'Remote source file {host}/{project}/{remote_version}{prefix_or_path_separator}{filename} not found')
-                    all_files_found = False
-                    continue
-                with open(f'tmp/{filename}', 'w') as source_file:
-                    source_file.write(response_text)
+                    _log(observer, f'Remote manifest of version {remote_version} not found, updating all files')
+            removed_filenames = []
+            if manifest is not None:
+                local_manifest = _read_local_manifest() if installed_dir is not None else {}
+                filenames = [filename for filename in manifest if manifest[filename] != local_manifest.get(filename) or
+                             not _file_exists(f'{installed_dir}/{filename}' if installed_dir else filename)]
+                removed_filenames = [filename for filename in local_manifest if filename not in manifest]
+            peer_hosts = []
+            if peer is not None and peer.project == project and manifest is not None and not bundle:
+                peer_hosts = peer.discover(remote_version)
+                _log(observer, f'Found {len(peer_hosts)} peers serving version {remote_version}')
+            journal = _start_journal(remote_version)
+            if bundle:
+                digests = {filename: manifest[filename].get('sha256') for filename in manifest} if manifest is not None else None
+                required_filenames = filenames if manifest is not None else None
+                bundle_name = f'{remote_version}.{bundle}'
+                download_started = utime.ticks_ms()
+                stats = {'status': None, 'bytes': 0, 'retries': 0, 'patched': False, 'mirror': None}
+                filenames = None
+                for attempt, mirror in enumerate(hosts):
+                    stats.update({'status': None, 'retries': attempt, 'mirror': mirror})
+                    _emit(observer, 'download_start', {'filename': bundle_name, 'mirror': mirror, 'attempt': attempt})
+                    try:
+                        filenames = _download_bundle(sessions.get(mirror), mirror, project, remote_version, bundle, buffer, digests, stats,
+                                                     required_filenames)
+                    except (OSError, ValueError) as ex:
+                        _log(observer, f'Downloading bundle from {mirror} failed: {ex}')
+                    if filenames is not None:
+                        break
+                    if stats['status'] is not None:
+                        _log(observer, f'Remote bundle {mirror}/{project}/{bundle_name} not found')
+                all_files_found = filenames is not None
+                _finish_download(observer, result, bundle_name, stats, all_files_found, download_started)
+            else:
+                sources = [(mirror, peer_sessions.get(mirror), '/', True) for mirror in peer_hosts] + \
+                          [(mirror, sessions.get(mirror), prefix_or_path_separator, False) for mirror in hosts]
+                all_files_found = _download_files(filenames, journal, sources, project, remote_version, manifest, buffer, result, observer, use_compression,
+                                                  verify_hash, use_patches, current_version, installed_dir)
             if all_files_found:
-                for filename in filenames:
-                    with open(f'tmp/{filename}', 'r') as source_file, open(filename, 'w') as target_file:
-                        target_file.write(source_file.read())
-                    uos.remove(f'tmp/{filename}')
-                try:
-                    uos.rmdir('tmp')
-                except:
-                    pass
-                with open('version', 'w') as current_version_file:
-                    current_version_file.write(remote_version)
-                if soft_reset_device:
-                    print('Soft-resetting device...')
-                    machine.soft_reset()
-                if hard_reset_device:
-                    print('Hard-resetting device...')
-                    machine.reset()
+                slot = None
+                if use_slots:
+                    slot = _inactive_slot(slot_state)
+                    if manifest is not None and not bundle:
+                        for filename in manifest:
+                            if filename not in filenames:
+                                _makedirs(f'tmp/{filename}')
+                                _copy_file(f'{installed_dir}/{filename}', f'tmp/{filename}', buffer)
+                        filenames = list(manifest)
+                    _remove_tree(slot)
+                journal.update({'files': filenames, 'removed': removed_filenames, 'manifest': manifest, 'slot': slot, 'previous_slot': installed_dir or None})
+                _commit_update(journal, result, observer)
+                if check_ttl:
+                    _record_check(remote_version)
+                _reset_after_update(result, started, hard_reset_device, soft_reset_device, observer)
     except Exception as ex:
-        print(f'Something went wrong: {ex}')
+        result['error'] = str(ex)
+        _log(observer, f'Something went wrong: {ex}')
+    finally:
+        sessions.close()
+        peer_sessions.close()
+    result['duration_ms'] = utime.ticks_diff(utime.ticks_ms(), started)
+    return result
 
 
-def check_for_ota_update(host, project, user=None, passwd=None, timeout=5, soft_reset_device=False):
+def check_for_ota_update(host, project, user=None, passwd=None, timeout=5, soft_reset_device=False, observer=None):
     auth = generate_auth(user, passwd)
-    version_changed, remote_version = check_version(host, project, auth=auth, timeout=timeout)
+    hosts = _mirror_list(host)
+    if len(hosts) > 1:
+        version_changed, remote_version = _check_preferred_mirror(hosts, project, auth=auth, timeout=timeout, observer=observer)
+    else:
+        version_changed, remote_version = check_version(hosts[0], project, auth=auth, timeout=timeout, observer=observer)
     if version_changed:
-        if soft_reset_device:
-            print(f'Found new version {remote_version}, soft-resetting device...')
-            machine.soft_reset()
+        _reset_for_new_version(remote_version, soft_reset_device, observer)
+
+
+def _reset_for_new_version(remote_version, soft_reset_device, observer) -> None:
+    _mark_update_pending(remote_version)
+    _emit(observer, 'reset', {'soft': soft_reset_device, 'version': remote_version})
+    if soft_reset_device:
+        _log(observer, f'Found new version {remote_version}, soft-resetting device...')
+        machine.soft_reset()
+    else:
+        _log(observer, f'Found new version {remote_version}, hard-resetting device...')
+        machine.reset()
+
+
+def _read_projects_state() -> dict:
+    try:
+        with open('projects.json', 'r') as projects_file:
+            return ujson.load(projects_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _get_index(session, host, details, observer=None) -> dict | None:
+    index_url = f'{host}/index.json'
+    validators = _read_version_validators(index_url) if _file_exists('projects_index.json') else {}
+    response = session.get(index_url, _conditional_headers(validators))
+    details['status'] = response.status_code
+    if response.status_code == 304 and validators:
+        response.close()
+        with open('projects_index.json', 'r') as index_file:
+            return ujson.load(index_file)['projects']
+    response_text = response.text
+    etag = _get_header(response, 'ETag')
+    last_modified = _get_header(response, 'Last-Modified')
+    response.close()
+    if response.status_code != 200:
+        _log(observer, f'Remote index {index_url} not found')
+        return None
+    index = ujson.loads(response_text)
+    if etag or last_modified:
+        with open('projects_index.json', 'w') as index_file:
+            index_file.write(response_text)
+    else:
+        _remove_file('projects_index.json')
+    _write_version_validators(index_url, {'version': None, 'etag': etag, 'last_modified': last_modified})
+    return index['projects']
+
+
+def _check_index(session, host, projects, details, observer=None) -> (dict, dict):
+    started = utime.ticks_ms()
+    try:
+        index = _get_index(session, host, details, observer)
+    except Exception as ex:
+        details['status'] = None
+        _log(observer, f'Something went wrong: {ex}')
+        index = None
+    projects_state = _read_projects_state()
+    checks = {}
+    for project in projects:
+        current_version = projects_state.get(project, {}).get('version', '')
+        entry = (index or {}).get(project)
+        if entry is None:
+            checks[project] = (False, current_version)
+        else:
+            checks[project] = (_is_new_version(current_version, entry['version'], entry.get('attributes'), observer, use_slots=False), entry['version'])
+    details['duration_ms'] = utime.ticks_diff(utime.ticks_ms(), started)
+    _emit(observer, 'index_check', {'host': host, 'status': details['status'], 'duration_ms': details['duration_ms'],
+                                    'changed': [project for project in checks if checks[project][0]]})
+    return checks, index or {}
+
+
+def check_projects(host, projects, auth=None, timeout=5, session=None, details=None, observer=None) -> dict:
+    details = {} if details is None else details
+    return _check_index(session or _UrequestsSession(auth, timeout), host, projects, details, observer)[0]
+
+
+def ota_update_projects(host, projects, use_version_prefix=True, user=None, passwd=None, hard_reset_device=True, soft_reset_device=False, timeout=5,
+                        chunk_size=1024, use_compression=False, keep_alive=False, observer=None) -> dict:
+    started = utime.ticks_ms()
+    result = {'projects': {}, 'updated': False, 'files': {}, 'bytes': 0, 'duration_ms': 0, 'error': None}
+    projects = projects if isinstance(projects, dict) else {project: None for project in projects}
+    auth = generate_auth(user, passwd)
+    prefix_or_path_separator = '_' if use_version_prefix else '/'
+    buffer = bytearray(chunk_size)
+    sessions = _MirrorSessions(auth, timeout, keep_alive)
+    session = sessions.get(host)
+    try:
+        _complete_interrupted_commit(observer)
+        checks, index = _check_index(session, host, list(projects), {}, observer)
+        projects_state = _read_projects_state()
+        for project, (version_changed, remote_version) in checks.items():
+            result['projects'][project] = {'current_version': projects_state.get(project, {}).get('version', ''), 'remote_version': remote_version,
+                                           'changed': version_changed}
+        changed_projects = [project for project in checks if checks[project][0]]
+        if changed_projects:
+            journal = _start_journal(','.join(f'{project}@{checks[project][1]}' for project in changed_projects))
+            all_files_found = True
+            installed_filenames = []
+            removed_filenames = []
+            installed_projects = {}
+            for project in changed_projects:
+                remote_version = checks[project][1]
+                manifest = index[project].get('files')
+                filenames = projects[project]
+                if manifest is not None:
+                    local_manifest = projects_state.get(project, {}).get('manifest') or {}
+                    filenames = [filename for filename in manifest if manifest[filename] != local_manifest.get(filename) or not _file_exists(filename)]
+                    removed_filenames.extend(filename for filename in local_manifest if filename not in manifest)
+                elif filenames is None:
+                    _log(observer, f'Neither filenames nor a manifest given for project {project}')
+                    all_files_found = False
+                    continue
+                installed_projects[project] = {'version': remote_version, 'manifest': manifest}
+                installed_filenames.extend(filenames)
+                if not _download_files(filenames, journal, [(host, session, prefix_or_path_separator, False)], project, remote_version, manifest, buffer,
+                                       result, observer, use_compression, extra_stats={'project': project}):
+                    all_files_found = False
+            if all_files_found:
+                projects_after_update = dict(projects_state)
+                projects_after_update.update(installed_projects)
+                kept_filenames = set(installed_filenames)
+                for project_state in projects_after_update.values():
+                    kept_filenames.update(project_state.get('manifest') or {})
+                removed_filenames = [filename for filename in removed_filenames if filename not in kept_filenames]
+                journal.update({'files': installed_filenames, 'removed': removed_filenames, 'projects': installed_projects})
+                _commit_update(journal, result, observer)
+                _reset_after_update(result, started, hard_reset_device, soft_reset_device, observer)
+    except Exception as ex:
+        result['error'] = str(ex)
+        _log(observer, f'Something went wrong: {ex}')
+    finally:
+        sessions.close()
+    result['duration_ms'] = utime.ticks_diff(utime.ticks_ms(), started)
+    return result
+
+
+class OtaScheduler:
+    def __init__(self, host, project, user=None, passwd=None, timeout=5, interval=60, jitter=0.2, max_backoff=3600, soft_reset_device=False,
+                 observer=None):
+        self.host = host
+        self.project = project
+        self.auth = generate_auth(user, passwd)
+        self.timeout = timeout
+        self.base_interval = interval
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.soft_reset_device = soft_reset_device
+        self.observer = observer
+        self.errors = 0
+        self.next_poll = utime.ticks_ms()
+        self._schedule()
+
+    def _schedule(self, min_delay=0) -> None:
+        import urandom
+        delay = self.interval
+        if self.errors:
+            delay = min(self.interval * 2 ** min(self.errors, 16), max(self.interval, self.max_backoff))
+        delay *= 1 + self.jitter * (2 * urandom.getrandbits(16) / 65535 - 1)
+        delay = max(delay, min_delay)
+        self.next_poll = utime.ticks_add(utime.ticks_ms(), int(delay * 1000))
+
+    def due(self) -> bool:
+        return utime.ticks_diff(utime.ticks_ms(), self.next_poll) >= 0
+
+    def poll(self) -> (bool, str):
+        details = {}
+        hosts = _mirror_list(self.host)
+        if len(hosts) > 1:
+            version_changed, remote_version = _check_preferred_mirror(hosts, self.project, auth=self.auth, timeout=self.timeout, details=details,
+                                                                       observer=self.observer)
         else:
-            print(f'Found new version {remote_version}, hard-resetting device...')
-            machine.reset()
+            version_changed, remote_version = check_version(hosts[0], self.project, auth=self.auth, timeout=self.timeout, details=details,
+                                                           observer=self.observer)
+        if details.get('status') in (200, 304):
+            self.errors = 0
+            poll_interval = details['attributes'].get('poll_interval')
+            if poll_interval and poll_interval.isdigit() and int(poll_interval) > 0:
+                self.interval = int(poll_interval)
+            else:
+                self.interval = details.get('max_age') or self.base_interval
+            self._schedule()
+        else:
+            self.errors += 1
+            self._schedule(details.get('retry_after') or 0)
+        return version_changed, remote_version
+
+    def check_for_ota_update(self) -> None:
+        if not self.due():
+            return
+        version_changed, remote_version = self.poll()
+        if version_changed:
+            _reset_for_new_version(remote_version, self.soft_reset_device, self.observer)
@@ -0,0 +1,152 @@
+import machine
+import uasyncio
+
+from micropython_ota import (_commit, _complete_interrupted_commit, _conditional_headers, _expected_file_size, _file_size, _get_header, _is_new_version,
+                             _makedirs, _parse_version_file, _read_current_version, _read_version_validators, _start_journal, _write_journal,
+                             _write_version_validators, generate_auth)
+from micropython_ota_http import _build_request, _parse_url
+
+
+class _AsyncResponse:
+    def __init__(self, status_code, headers, reader, writer, timeout):
+        self.status_code = status_code
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+
+    async def read(self, size):
+        return await uasyncio.wait_for(self.reader.read(size), self.timeout)
+
+    async def text(self) -> str:
+        content = b''
+        while True:
+            data = await self.read(512)
+            if not data:
+                return content.decode()
+            content += data
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def _http_get_async(url, auth=None, timeout=5, headers=None) -> _AsyncResponse:
+    scheme, host, port, path = _parse_url(url)
+    if scheme == 'https':
+        reader, writer = await uasyncio.wait_for(uasyncio.open_connection(host, port, ssl=True), timeout)
+    else:
+        reader, writer = await uasyncio.wait_for(uasyncio.open_connection(host, port), timeout)
+    headers = dict(headers) if headers else {}
+    if auth:
+        headers['Authorization'] = f'Basic {auth}'
+    try:
+        writer.write(_build_request('GET', host, path, headers))
+        await writer.drain()
+        status_line = await uasyncio.wait_for(reader.readline(), timeout)
+        status_code = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            header_line = await uasyncio.wait_for(reader.readline(), timeout)
+            if header_line in (b'\r\n', b''):
+                break
+            name, _, value = header_line.decode().partition(':')
+            response_headers[name.strip()] = value.strip()
+    except Exception:
+        writer.close()
+        await writer.wait_closed()
+        raise
+    return _AsyncResponse(status_code, response_headers, reader, writer, timeout)
+
+
+async def check_version_async(host, project, auth=None, timeout=5) -> (bool, str):
+    current_version = ''
+    try:
+        current_version = _read_current_version()
+        version_url = f'{host}/{project}/version'
+        validators = _read_version_validators(version_url)
+        response = await _http_get_async(version_url, auth, timeout, _conditional_headers(validators))
+        try:
+            if response.status_code == 304 and validators.get('version'):
+                return _is_new_version(current_version, validators['version'], validators.get('attributes')), validators['version']
+            if response.status_code != 200:
+                print(f'Remote version file {host}/{project}/version not found')
+                return False, current_version
+            remote_version, attributes = _parse_version_file(await response.text())
+        finally:
+            await response.close()
+        _write_version_validators(version_url, {'version': remote_version, 'etag': _get_header(response, 'ETag'),
+                                                'last_modified': _get_header(response, 'Last-Modified'), 'attributes': attributes})
+        return _is_new_version(current_version, remote_version, attributes), remote_version
+    except Exception as ex:
+        print(f'Something went wrong: {ex}')
+        return False, current_version
+
+
+async def _download_file_async(file_url, target_filename, auth, timeout, chunk_size) -> bool:
+    offset = _file_size(target_filename)
+    response = await _http_get_async(file_url, auth, timeout, {'Range': f'bytes={offset}-'} if offset else None)
+    if response.status_code == 416:
+        await response.close()
+        response = await _http_get_async(file_url, auth, timeout)
+    try:
+        if response.status_code not in (200, 206):
+            print(f'Remote source file {file_url} not found')
+            return False
+        _makedirs(target_filename)
+        with open(target_filename, 'ab' if response.status_code == 206 else 'wb') as target_file:
+            while True:
+                data = await response.read(chunk_size)
+                if not data:
+                    break
+                target_file.write(data)
+        expected_size = _expected_file_size(response)
+        if expected_size is not None and _file_size(target_filename) != expected_size:
+            raise OSError(f'Incomplete download, received {_file_size(target_filename)} of {expected_size} bytes')
+        return True
+    finally:
+        await response.close()
+
+
+async def ota_update_async(host, project, filenames, use_version_prefix=True, user=None, passwd=None, hard_reset_device=True, soft_reset_device=False,
+                           timeout=5, chunk_size=1024, max_concurrency=2) -> None:
+    auth = generate_auth(user, passwd)
+    prefix_or_path_separator = '_' if use_version_prefix else '/'
+    try:
+        _complete_interrupted_commit()
+        version_changed, remote_version = await check_version_async(host, project, auth=auth, timeout=timeout)
+        if not version_changed:
+            return
+        journal = _start_journal(remote_version)
+        pending_filenames = [filename for filename in filenames if filename not in journal['done']]
+        failed_filenames = []
+
+        async def download_worker():
+            while pending_filenames:
+                filename = pending_filenames.pop(0)
+                file_url = f'{host}/{project}/{remote_version}{prefix_or_path_separator}{filename}'
+                try:
+                    downloaded = await _download_file_async(file_url, f'tmp/{filename}', auth, timeout, chunk_size)
+                except Exception as ex:
+                    print(f'Download of {file_url} failed: {ex}')
+                    downloaded = False
+                if downloaded:
+                    journal['done'].append(filename)
+                    _write_journal(journal)
+                else:
+                    failed_filenames.append(filename)
+
+        await uasyncio.gather(*[download_worker() for _ in range(max(1, min(max_concurrency, len(pending_filenames))))])
+        if failed_filenames:
+            return
+        journal.update({'commit': True, 'files': filenames, 'removed': [], 'manifest': None, 'slot': None})
+        _write_journal(journal)
+        _commit(journal)
+        if soft_reset_device:
+            print('Soft-resetting device...')
+            machine.soft_reset()
+        if hard_reset_device:
+            print('Hard-resetting device...')
+            machine.reset()
+    except Exception as ex:
+        print(f'Something went wrong: {ex}')
@@ -0,0 +1,171 @@
+import io
+import usocket
+
+
+def _parse_url(url) -> (str, str, int, str):
+    scheme, _, address = url.partition('://')
+    host, _, path = address.partition('/')
+    port = 443 if scheme == 'https' else 80
+    if ':' in host:
+        host, port = host.split(':')
+        port = int(port)
+    return scheme, host, port, f'/{path}'
+
+
+def _build_request(method, host, path, headers, protocol='HTTP/1.0') -> bytes:
+    request = f'{method} {path} {protocol}\r\nHost: {host}\r\n'
+    for name in headers:
+        request += f'{name}: {headers[name]}\r\n'
+    return f'{request}\r\n'.encode()
+
+
+class _BodyReader(io.IOBase):
+    def ioctl(self, request, argument) -> int:
+        return 0
+
+
+class _ContentLengthReader(_BodyReader):
+    def __init__(self, stream, content_length):
+        self.stream = stream
+        self.remaining = content_length
+
+    def readinto(self, buffer) -> int:
+        if not self.remaining:
+            return 0
+        bytes_read = self.stream.readinto(memoryview(buffer)[:min(len(buffer), self.remaining)])
+        if not bytes_read:
+            raise OSError('Connection closed before the response was complete')
+        self.remaining -= bytes_read
+        return bytes_read
+
+
+class _ChunkedReader(_BodyReader):
+    def __init__(self, stream):
+        self.stream = stream
+        self.remaining = 0
+        self.complete = False
+
+    def readinto(self, buffer) -> int:
+        if self.complete:
+            return 0
+        if not self.remaining:
+            self.remaining = int(self.stream.readline().split(b';')[0].strip(), 16)
+            if not self.remaining:
+                while self.stream.readline() not in (b'\r\n', b''):
+                    pass
+                self.complete = True
+                return 0
+        bytes_read = self.stream.readinto(memoryview(buffer)[:min(len(buffer), self.remaining)])
+        if not bytes_read:
+            raise OSError('Connection closed before the response was complete')
+        self.remaining -= bytes_read
+        if not self.remaining:
+            self.stream.readline()
+        return bytes_read
+
+
+class _SessionResponse:
+    def __init__(self, session, status_code, headers, raw, reusable):
+        self.session = session
+        self.status_code = status_code
+        self.headers = headers
+        self.raw = raw
+        self.reusable = reusable
+
+    @property
+    def text(self) -> str:
+        content = b''
+        buffer = bytearray(256)
+        while True:
+            bytes_read = self.raw.readinto(buffer)
+            if not bytes_read:
+                return content.decode()
+            content += buffer[:bytes_read]
+
+    def close(self) -> None:
+        if self.session is None:
+            return
+        try:
+            buffer = bytearray(256)
+            while self.reusable and self.raw.readinto(buffer):
+                pass
+        except OSError:
+            self.reusable = False
+        if not self.reusable:
+            self.session.close()
+        self.session = None
+
+
+class HttpSession:
+    def __init__(self, host, auth=None, timeout=5):
+        self.scheme, self.hostname, self.port, _ = _parse_url(host)
+        self.headers = {'Authorization': f'Basic {auth}'} if auth else {}
+        self.timeout = timeout
+        self.sock = None
+        self.stream = None
+
+    def _connect(self) -> None:
+        address = usocket.getaddrinfo(self.hostname, self.port, 0, usocket.SOCK_STREAM)[0][-1]
+        sock = usocket.socket(usocket.AF_INET, usocket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(address)
+            if self.scheme == 'https':
+                import ussl
+                sock = ussl.wrap_socket(sock, server_hostname=self.hostname)
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+        self.stream = sock if hasattr(sock, 'readline') else sock.makefile('rwb', 0)
+
+    def _write(self, data) -> None:
+        data_view = memoryview(data)
+        while data_view:
+            data_view = data_view[self.stream.write(data_view):]
+
+    def get(self, url, headers=None) -> _SessionResponse:
+        _, _, _, path = _parse_url(url)
+        request_headers = dict(self.headers)
+        if headers:
+            request_headers.update(headers)
+        request = _build_request('GET', self.hostname, path, request_headers, 'HTTP/1.1')
+        while True:
+            reused = self.sock is not None
+            if not reused:
+                self._connect()
+            try:
+                self._write(request)
+                status_line = self.stream.readline()
+                if not status_line:
+                    raise OSError('Connection closed by server')
+                break
+            except OSError:
+                self.close()
+                if not reused:
+                    raise
+        status_code = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            header_line = self.stream.readline()
+            if header_line in (b'\r\n', b''):
+                break
+            name, _, value = header_line.decode().partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        reusable = response_headers.get('connection', '').lower() != 'close' and status_line.startswith(b'HTTP/1.1')
+        if status_code in (204, 304) or 100 <= status_code < 200:
+            raw = _ContentLengthReader(self.stream, 0)
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            raw = _ChunkedReader(self.stream)
+        elif 'content-length' in response_headers:
+            raw = _ContentLengthReader(self.stream, int(response_headers['content-length']))
+        else:
+            raw = self.stream
+            reusable = False
+        return _SessionResponse(self, status_code, response_headers, raw, reusable)
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.stream = None
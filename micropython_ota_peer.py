@@ -0,0 +1,165 @@
+import ujson
+import urandom
+import usocket
+import utime
+
+from micropython_ota import _file_exists, _file_size
+
+
+class OtaPeer:
+    def __init__(self, project, port=8268, announce_port=8267, broadcast_address='255.255.255.255', interval=10, root='', chunk_size=1024, timeout=2,
+                 max_transfers=2, auth=None):
+        self.project = project
+        self.auth = auth
+        self.announce_port = announce_port
+        self.broadcast_address = broadcast_address
+        self.interval = interval
+        self.root = root
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_transfers = max_transfers
+        self.transfers = []
+        self.id = urandom.getrandbits(30)
+        self.peers = {}
+        self.files_dir = root
+        self.version, self.manifest = self._read_installed_release()
+        self.server = usocket.socket(usocket.AF_INET, usocket.SOCK_STREAM)
+        self.server.setsockopt(usocket.SOL_SOCKET, usocket.SO_REUSEADDR, 1)
+        self.server.bind(usocket.getaddrinfo('0.0.0.0', port)[0][-1])
+        self.server.listen(2)
+        self.server.setblocking(False)
+        self.port = port or self.server.getsockname()[1]
+        self.udp = usocket.socket(usocket.AF_INET, usocket.SOCK_DGRAM)
+        self.udp.setsockopt(usocket.SOL_SOCKET, usocket.SO_REUSEADDR, 1)
+        self.udp.setsockopt(usocket.SOL_SOCKET, getattr(usocket, 'SO_BROADCAST', 0x20), 1)
+        self.udp.bind(usocket.getaddrinfo('0.0.0.0', announce_port)[0][-1])
+        self.udp.setblocking(False)
+        self.next_announce = utime.ticks_ms()
+
+    def _path(self, filename) -> str:
+        return f'{self.root}/{filename}' if self.root else filename
+
+    def _read_installed_release(self) -> (str, dict):
+        try:
+            with open(self._path('version'), 'r') as current_version_file:
+                version = current_version_file.readline().strip()
+            with open(self._path('manifest.json'), 'r') as manifest_file:
+                manifest = ujson.load(manifest_file)['files']
+        except (OSError, ValueError, KeyError):
+            return '', {}
+        try:
+            with open(self._path('slots.json'), 'r') as slot_state_file:
+                self.files_dir = self._path(ujson.load(slot_state_file).get('active') or '').rstrip('/')
+        except (OSError, ValueError):
+            pass
+        return version, manifest
+
+    def _installed_path(self, filename) -> str:
+        return f'{self.files_dir}/{filename}' if self.files_dir else filename
+
+    def announce(self) -> None:
+        if not self.version or not self.manifest:
+            return
+        announcement = ujson.dumps({'ota': self.id, 'project': self.project, 'version': self.version, 'port': self.port})
+        self.udp.sendto(announcement.encode(), usocket.getaddrinfo(self.broadcast_address, self.announce_port)[0][-1])
+
+    def _receive_announcements(self) -> None:
+        while True:
+            try:
+                data, address = self.udp.recvfrom(256)
+            except OSError:
+                return
+            try:
+                announcement = ujson.loads(data)
+                if announcement['ota'] == self.id or announcement['project'] != self.project:
+                    continue
+                self.peers.setdefault(announcement['version'], {})[f'http://{address[0]}:{announcement["port"]}'] = utime.ticks_ms()
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    def _write(self, stream, data) -> None:
+        data_view = memoryview(data)
+        while data_view:
+            data_view = data_view[stream.write(data_view):]
+
+    def _accept(self) -> None:
+        while len(self.transfers) < self.max_transfers:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            transfer = None
+            try:
+                client.setblocking(True)
+                client.settimeout(self.timeout)
+                stream = client if hasattr(client, 'readline') else client.makefile('rwb', 0)
+                request_line = stream.readline().decode()
+                authorization = None
+                while True:
+                    header_line = stream.readline()
+                    if header_line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header_line.decode().partition(':')
+                    if name.strip().lower() == 'authorization':
+                        authorization = value.strip()
+                parts = request_line.split()
+                prefix = f'/{self.project}/{self.version}/'
+                filename = parts[1][len(prefix):] if len(parts) > 1 and parts[0] == 'GET' and parts[1].startswith(prefix) else None
+                if self.auth and authorization != f'Basic {self.auth}':
+                    self._write(stream, b'HTTP/1.0 401 Unauthorized\r\nWWW-Authenticate: Basic realm="ota"\r\nContent-Length: 0\r\n\r\n')
+                elif not self.version or filename not in self.manifest or not _file_exists(self._installed_path(filename)):
+                    self._write(stream, b'HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                else:
+                    header = f'HTTP/1.0 200 OK\r\nContent-Length: {_file_size(self._installed_path(filename))}\r\n\r\n'.encode()
+                    transfer = [client, stream, open(self._installed_path(filename), 'rb'), bytearray(self.chunk_size), memoryview(header)]
+                    client.setblocking(False)
+            except OSError as ex:
+                print(f'Serving peer request failed: {ex}')
+            if transfer:
+                self.transfers.append(transfer)
+            else:
+                client.close()
+
+    def _close_transfer(self, transfer) -> None:
+        self.transfers.remove(transfer)
+        transfer[2].close()
+        transfer[0].close()
+
+    def _send(self) -> None:
+        for transfer in list(self.transfers):
+            _, stream, source_file, buffer, pending = transfer
+            try:
+                if not pending:
+                    bytes_read = source_file.readinto(buffer)
+                    if not bytes_read:
+                        self._close_transfer(transfer)
+                        continue
+                    pending = memoryview(buffer)[:bytes_read]
+                transfer[4] = pending[stream.write(pending) or 0:]
+            except OSError as ex:
+                print(f'Serving peer request failed: {ex}')
+                self._close_transfer(transfer)
+
+    def poll(self) -> None:
+        self._accept()
+        self._send()
+        self._receive_announcements()
+        if utime.ticks_diff(utime.ticks_ms(), self.next_announce) >= 0:
+            self.announce()
+            self.next_announce = utime.ticks_add(utime.ticks_ms(), self.interval * 1000)
+
+    def discover(self, version, timeout_ms=3000) -> list:
+        started = utime.ticks_ms()
+        while True:
+            self._receive_announcements()
+            peers = self.peers.get(version, {})
+            fresh_peers = [peer for peer in peers if utime.ticks_diff(utime.ticks_ms(), peers[peer]) < 3 * self.interval * 1000]
+            if fresh_peers or utime.ticks_diff(utime.ticks_ms(), started) >= timeout_ms:
+                return fresh_peers
+            utime.sleep_ms(50)
+
+    def close(self) -> None:
+        for transfer in list(self.transfers):
+            self._close_transfer(transfer)
+        self.server.close()
+        self.udp.close()
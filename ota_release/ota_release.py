@@ -0,0 +1,303 @@
+#
+# Release tooling for micropython_ota, run on the host (CPython) to prepare the files served to the devices.
+#
+# Commands:
+#  * build: Cross-compiles the .py files of a project with mpy-cross into .mpy files (except boot.py and main.py, which MicroPython only runs as source) and
+#    writes them with the other files and the manifest into the versioned server layout of the project. Finally the version file is written, publishing
+#    the release.
+#  * manifest: Writes the manifest (filename -> size and SHA-256) of a release directory, enabling delta updates on the devices.
+#  * bundle: Packs a release directory into a single <version>.tar or <version>.tar.gz, the latter compressed with a 4K window (see sdist_upip.gzip_4k) so
+#    low-heap devices can extract it while streaming.
+#  * checksums: Writes a <file>.sha256 next to each release file of a directory (skipping the version file, manifests, checksums, patches and bundles),
+#    verified by the devices when updating with verify_hash=True.
+#  * patch: Writes binary delta patches from one release directory to the next, applied by the devices against their installed files with use_patches=True.
+#    A patch consists of the header b'OTAP\x01' followed by operations: b'C' + offset + length (4 bytes big-endian each) copies a block of the installed
+#    file, b'I' + length + data inserts new data and b'E' ends the patch.
+#  * index: Writes the index of a server root (version, version file attributes and optionally the manifest of each project), enabling devices running
+#    several projects to check all of them with a single request (ota_update_projects).
+#  * compress: Writes a gzip-compressed <file>.gz (4K window) next to each release file of a directory (skipping the same files as checksums) for
+#    compressed per-file transfers.
+#
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sdist_upip'))
+import sdist_upip
+
+
+def list_release_files(release_dir) -> list:
+    filenames = []
+    for root, _, files in os.walk(release_dir):
+        for name in files:
+            filenames.append(os.path.relpath(os.path.join(root, name), release_dir).replace(os.sep, '/'))
+    return sorted(filenames)
+
+
+def list_payload_files(directory) -> list:
+    return [filename for filename in list_release_files(directory) if filename not in ('version', 'index.json') and
+            os.path.basename(filename) != 'manifest.json' and not filename.endswith(('_manifest.json', '.sha256', '.patch', '.tar', '.gz'))]
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(release_dir) -> dict:
+    files = {}
+    for filename in list_release_files(release_dir):
+        path = os.path.join(release_dir, filename)
+        files[filename] = {'size': os.path.getsize(path), 'sha256': file_sha256(path)}
+    return {'files': files}
+
+
+def write_manifest(release_dir, output) -> None:
+    with open(output, 'w') as manifest_file:
+        json.dump(build_manifest(release_dir), manifest_file, indent=2, sort_keys=True)
+
+
+def build_bundle(release_dir, output) -> None:
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w', format=tarfile.USTAR_FORMAT) as tar:
+        for filename in list_release_files(release_dir):
+            tar.add(os.path.join(release_dir, filename), arcname=filename, recursive=False)
+    tar_buffer.seek(0)
+    with open(output, 'wb') as bundle_file:
+        if output.endswith('.gz'):
+            sdist_upip.gzip_4k_stream(tar_buffer, bundle_file)
+        else:
+            bundle_file.write(tar_buffer.getvalue())
+
+
+def write_checksums(directory) -> None:
+    for filename in list_payload_files(directory):
+        path = os.path.join(directory, filename)
+        with open(f'{path}.sha256', 'w') as checksum_file:
+            checksum_file.write(f'{file_sha256(path)}  {os.path.basename(path)}\n')
+
+
+PATCH_MAGIC = b'OTAP\x01'
+PATCH_BLOCK_SIZE = 32
+
+
+def build_patch(old, new, block_size=PATCH_BLOCK_SIZE) -> bytes:
+    index = {}
+    for offset in range(0, len(old) - block_size + 1, block_size):
+        index.setdefault(old[offset:offset + block_size], offset)
+    patch = bytearray(PATCH_MAGIC)
+    insert = bytearray()
+
+    def flush_insert():
+        if insert:
+            patch.extend(b'I' + struct.pack('>I', len(insert)) + insert)
+            insert.clear()
+
+    position = 0
+    while position < len(new):
+        offset = index.get(new[position:position + block_size]) if position + block_size <= len(new) else None
+        if offset is None:
+            insert.append(new[position])
+            position += 1
+            continue
+        while insert and offset and old[offset - 1] == insert[-1]:
+            insert.pop()
+            offset -= 1
+            position -= 1
+        length = 0
+        while position + length < len(new) and offset + length < len(old) and new[position + length] == old[offset + length]:
+            length += 1
+        flush_insert()
+        patch.extend(b'C' + struct.pack('>II', offset, length))
+        position += length
+    flush_insert()
+    patch.extend(b'E')
+    return bytes(patch)
+
+
+def apply_patch(old, patch) -> bytes:
+    if patch[:len(PATCH_MAGIC)] != PATCH_MAGIC:
+        raise ValueError('Invalid patch')
+    new = bytearray()
+    position = len(PATCH_MAGIC)
+    while patch[position:position + 1] != b'E':
+        if patch[position:position + 1] == b'C':
+            offset, length = struct.unpack('>II', patch[position + 1:position + 9])
+            new.extend(old[offset:offset + length])
+            position += 9
+        elif patch[position:position + 1] == b'I':
+            length = struct.unpack('>I', patch[position + 1:position + 5])[0]
+            new.extend(patch[position + 5:position + 5 + length])
+            position += 5 + length
+        else:
+            raise ValueError(f'Invalid patch operation at {position}')
+    return bytes(new)
+
+
+def write_patches(old_release_dir, new_release_dir, output_dir, from_version, to_version, use_version_prefix=True) -> list:
+    prefix_or_path_separator = '_' if use_version_prefix else '/'
+    written = []
+    for filename in list_release_files(new_release_dir):
+        old_path = os.path.join(old_release_dir, filename)
+        if not os.path.isfile(old_path):
+            continue
+        with open(old_path, 'rb') as old_file, open(os.path.join(new_release_dir, filename), 'rb') as new_file:
+            old, new = old_file.read(), new_file.read()
+        if old == new:
+            continue
+        patch = build_patch(old, new)
+        if len(patch) >= len(new):
+            continue
+        patch_path = os.path.join(output_dir, f'{to_version}{prefix_or_path_separator}{filename}.{from_version}.patch')
+        os.makedirs(os.path.dirname(patch_path), exist_ok=True)
+        with open(patch_path, 'wb') as patch_file:
+            patch_file.write(patch)
+        written.append(patch_path)
+    return written
+
+
+def build_release(source_dir, output_dir, version, use_version_prefix=True, mpy_cross='mpy-cross', mpy_cross_args=(), keep_source=('boot.py', 'main.py'),
+                  write_version=True) -> list:
+    prefix_or_path_separator = '_' if use_version_prefix else '/'
+    with tempfile.TemporaryDirectory() as build_dir:
+        for filename in list_release_files(source_dir):
+            source_path = os.path.join(source_dir, filename)
+            if filename.endswith('.py') and filename not in keep_source:
+                filename = f'{filename[:-3]}.mpy'
+            build_path = os.path.join(build_dir, filename)
+            os.makedirs(os.path.dirname(build_path), exist_ok=True)
+            if filename.endswith('.mpy') and not source_path.endswith('.mpy'):
+                subprocess.run([mpy_cross, *mpy_cross_args, '-s', filename[:-4] + '.py', '-o', build_path, source_path], check=True)
+            else:
+                shutil.copyfile(source_path, build_path)
+        filenames = list_release_files(build_dir)
+        for filename in filenames:
+            output_path = os.path.join(output_dir, f'{version}{prefix_or_path_separator}{filename}')
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            shutil.copyfile(os.path.join(build_dir, filename), output_path)
+        write_manifest(build_dir, os.path.join(output_dir, f'{version}{prefix_or_path_separator}manifest.json'))
+    if write_version:
+        with open(os.path.join(output_dir, 'version'), 'w') as version_file:
+            version_file.write(version)
+    return filenames
+
+
+def read_version_file(path) -> (str, dict):
+    with open(path, 'r') as version_file:
+        lines = version_file.read().splitlines()
+    attributes = {}
+    for line in lines[1:]:
+        name, separator, value = line.partition('=')
+        if separator:
+            attributes[name.strip()] = value.strip()
+    return lines[0].strip(), attributes
+
+
+def build_index(server_root, projects=None, use_version_prefix=True, with_manifests=False) -> dict:
+    prefix_or_path_separator = '_' if use_version_prefix else '/'
+    if projects is None:
+        projects = sorted(project for project in os.listdir(server_root) if os.path.isfile(os.path.join(server_root, project, 'version')))
+    index = {}
+    for project in projects:
+        version, attributes = read_version_file(os.path.join(server_root, project, 'version'))
+        entry = {'version': version}
+        if attributes:
+            entry['attributes'] = attributes
+        manifest_path = os.path.join(server_root, project, f'{version}{prefix_or_path_separator}manifest.json')
+        if with_manifests and os.path.isfile(manifest_path):
+            with open(manifest_path, 'r') as manifest_file:
+                entry['files'] = json.load(manifest_file)['files']
+        index[project] = entry
+    return {'projects': index}
+
+
+def write_index(server_root, output=None, projects=None, use_version_prefix=True, with_manifests=False) -> None:
+    with open(output or os.path.join(server_root, 'index.json'), 'w') as index_file:
+        json.dump(build_index(server_root, projects, use_version_prefix, with_manifests), index_file, sort_keys=True)
+
+
+def compress_files(directory) -> None:
+    for filename in list_payload_files(directory):
+        path = os.path.join(directory, filename)
+        with open(path, 'rb') as source_file, open(f'{path}.gz', 'wb') as compressed_file:
+            sdist_upip.gzip_4k_stream(source_file, compressed_file)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Prepare micropython_ota releases')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='cross-compile a project and write it into the versioned server layout')
+    build_parser.add_argument('source_dir', help='directory containing the source files of the project')
+    build_parser.add_argument('output_dir', help='project directory on the server, e.g. <project>')
+    build_parser.add_argument('version', help='version tag of the release, e.g. v1.0.1')
+    build_parser.add_argument('--no-version-prefix', dest='use_version_prefix', action='store_false',
+                              help='write the files into the version subdirectory instead of prefixing them with the version')
+    build_parser.add_argument('--mpy-cross', default='mpy-cross', help='path of the mpy-cross executable')
+    build_parser.add_argument('--mpy-cross-arg', dest='mpy_cross_args', action='append', default=[],
+                              help='additional argument passed to mpy-cross, e.g. -march=xtensawin (may be repeated)')
+    build_parser.add_argument('--keep-source', action='append', help='.py file not to compile (may be repeated, defaults to boot.py and main.py)')
+    build_parser.add_argument('--no-version-file', dest='write_version', action='store_false', help='do not write the version file')
+
+    manifest_parser = commands.add_parser('manifest', help='write the manifest of a release directory')
+    manifest_parser.add_argument('release_dir', help='directory containing the files of one version')
+    manifest_parser.add_argument('output', help='path of the manifest to write, e.g. <project>/<version>_manifest.json')
+
+    bundle_parser = commands.add_parser('bundle', help='pack a release directory into a single archive')
+    bundle_parser.add_argument('release_dir', help='directory containing the files of one version')
+    bundle_parser.add_argument('output', help='path of the archive to write, <project>/<version>.tar or <project>/<version>.tar.gz')
+
+    checksums_parser = commands.add_parser('checksums', help='write a SHA-256 checksum file next to each release file of a directory')
+    checksums_parser.add_argument('directory', help='directory containing the files to checksum, e.g. <project>')
+
+    patch_parser = commands.add_parser('patch', help='write delta patches between two release directories')
+    patch_parser.add_argument('old_release_dir', help='directory containing the files of the version installed on the devices')
+    patch_parser.add_argument('new_release_dir', help='directory containing the files of the new version')
+    patch_parser.add_argument('output_dir', help='project directory on the server to write the patches to, e.g. <project>')
+    patch_parser.add_argument('from_version', help='version tag of the installed version, e.g. v1.0.0')
+    patch_parser.add_argument('to_version', help='version tag of the new version, e.g. v1.0.1')
+    patch_parser.add_argument('--no-version-prefix', dest='use_version_prefix', action='store_false',
+                              help='write the patches into the version subdirectory instead of prefixing them with the version')
+
+    index_parser = commands.add_parser('index', help='write the index of the projects of a server root')
+    index_parser.add_argument('server_root', help='document root of the server containing the project directories')
+    index_parser.add_argument('--output', help='path of the index to write, defaults to <server_root>/index.json')
+    index_parser.add_argument('--project', dest='projects', action='append', help='project to include (may be repeated, defaults to all projects)')
+    index_parser.add_argument('--manifests', dest='with_manifests', action='store_true', help='include the manifest of the current version of each project')
+    index_parser.add_argument('--no-version-prefix', dest='use_version_prefix', action='store_false',
+                              help='read the manifests from the version subdirectories instead of the version-prefixed files')
+
+    compress_parser = commands.add_parser('compress', help='write a gzip-compressed copy next to each release file of a directory')
+    compress_parser.add_argument('directory', help='directory containing the files to compress, e.g. <project>')
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        build_release(args.source_dir, args.output_dir, args.version, args.use_version_prefix, args.mpy_cross, args.mpy_cross_args,
+                      args.keep_source or ('boot.py', 'main.py'), args.write_version)
+    elif args.command == 'manifest':
+        write_manifest(args.release_dir, args.output)
+    elif args.command == 'bundle':
+        build_bundle(args.release_dir, args.output)
+    elif args.command == 'checksums':
+        write_checksums(args.directory)
+    elif args.command == 'patch':
+        write_patches(args.old_release_dir, args.new_release_dir, args.output_dir, args.from_version, args.to_version, args.use_version_prefix)
+    elif args.command == 'index':
+        write_index(args.server_root, args.output, args.projects, args.use_version_prefix, args.with_manifests)
+    elif args.command == 'compress':
+        compress_files(args.directory)
+
+
+if __name__ == '__main__':
+    main()
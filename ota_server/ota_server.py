@@ -0,0 +1,282 @@
+#
+# Reference OTA server for micropython_ota, run on the host (CPython, asyncio).
+#
+# The served root directory contains one directory per project, holding the version file and one directory per released version:
+#
+#   <root>/<project>/version
+#   <root>/<project>/<version>/main.py
+#   <root>/<project>/<version>/lib/library.py
+#
+# Each release is served in both layouts, <project>/<version>_<file> (use_version_prefix=True) and <project>/<version>/<file> (use_version_prefix=False).
+# Manifests (<version>_manifest.json), checksums (<file>.sha256) and gzip variants (<file>.gz, 4K window) are computed once at startup and kept in memory.
+# Bundles (<version>.tar, <version>.tar.gz) and patches from any other released version (<file>.<from_version>.patch) are computed on first request and
+# cached. The index of all projects (index.json, read by ota_update_projects) is built from the version files and the manifests of the current versions.
+# Any other file below the root (e.g. the version file) is served as-is from disk. Responses carry an ETag and honour If-None-Match and Range
+# requests, connections are kept alive for HTTP/1.1 clients. Only counters and the most recent requests (request_log_size) are kept for inspection.
+#
+import argparse
+import asyncio
+import base64
+import collections
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ota_release'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sdist_upip'))
+import ota_release
+import sdist_upip
+
+REASONS = {200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           405: 'Method Not Allowed', 416: 'Range Not Satisfiable'}
+
+
+def gzip_bytes(content) -> bytes:
+    compressed = io.BytesIO()
+    sdist_upip.gzip_4k_stream(io.BytesIO(content), compressed)
+    return compressed.getvalue()
+
+
+def etag_of(content) -> str:
+    return f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+
+
+def parse_range(range_header, length) -> tuple | None:
+    unit, _, byte_range = range_header.partition('=')
+    start, _, end = byte_range.strip().partition('-')
+    if unit.strip() != 'bytes' or ',' in byte_range or not (start.isdigit() or end.isdigit()):
+        raise ValueError(f'Unsupported range {range_header}')
+    if not start:
+        return max(length - int(end), 0), length
+    if int(start) >= length:
+        return None
+    return int(start), min(int(end) + 1, length) if end else length
+
+
+class Release:
+    def __init__(self, release_dir):
+        self.release_dir = release_dir
+        self.files = {}
+        for filename in ota_release.list_release_files(release_dir):
+            with open(os.path.join(release_dir, filename), 'rb') as release_file:
+                self.files[filename] = release_file.read()
+        self.manifest = json.dumps(ota_release.build_manifest(release_dir), sort_keys=True).encode()
+        self.checksums = {filename: f'{hashlib.sha256(content).hexdigest()}  {os.path.basename(filename)}\n'.encode()
+                          for filename, content in self.files.items()}
+        self.compressed = {filename: gzip_bytes(content) for filename, content in self.files.items()}
+        self.bundles = {}
+        self.patches = {}
+
+    def bundle(self, name) -> bytes:
+        if name not in self.bundles:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                output = os.path.join(tmp_dir, name)
+                ota_release.build_bundle(self.release_dir, output)
+                with open(output, 'rb') as bundle_file:
+                    self.bundles[name] = bundle_file.read()
+        return self.bundles[name]
+
+    def patch(self, filename, old_release) -> bytes | None:
+        key = (filename, old_release.release_dir)
+        if key not in self.patches:
+            old, new = old_release.files.get(filename), self.files[filename]
+            patch = ota_release.build_patch(old, new) if old is not None and old != new else None
+            self.patches[key] = patch if patch is not None and len(patch) < len(new) else None
+        return self.patches[key]
+
+
+class OtaServer:
+    def __init__(self, root, host='127.0.0.1', port=8000, user=None, passwd=None, max_age=None, request_log_size=100):
+        self.root = os.path.abspath(root)
+        self.host = host
+        self.port = port
+        self.auth = base64.b64encode(f'{user}:{passwd}'.encode()).decode() if user or passwd else None
+        self.max_age = max_age
+        self.releases = {}
+        self.requests = collections.deque(maxlen=request_log_size)
+        self.request_count = 0
+        self.statuses = collections.Counter()
+        self.connections = 0
+        self.bytes_sent = 0
+        self.server = None
+        self.loop = None
+        self.thread = None
+        self.load()
+
+    def load(self) -> None:
+        releases = {}
+        for project in sorted(os.listdir(self.root)):
+            project_dir = os.path.join(self.root, project)
+            if not os.path.isdir(project_dir):
+                continue
+            releases[project] = {version: Release(os.path.join(project_dir, version)) for version in sorted(os.listdir(project_dir))
+                                 if os.path.isdir(os.path.join(project_dir, version))}
+        self.releases = releases
+
+    def resolve(self, path) -> bytes | None:
+        project, _, resource = path.lstrip('/').partition('/')
+        for version, release in self.releases.get(project, {}).items():
+            if resource in (f'{version}.tar', f'{version}.tar.gz'):
+                return release.bundle(resource)
+            if not (resource.startswith(f'{version}_') or resource.startswith(f'{version}/')):
+                continue
+            name = resource[len(version) + 1:]
+            if name in release.files:
+                return release.files[name]
+            if name == 'manifest.json':
+                return release.manifest
+            if name.endswith('.gz') and name[:-3] in release.files:
+                return release.compressed[name[:-3]]
+            if name.endswith('.sha256') and name[:-7] in release.checksums:
+                return release.checksums[name[:-7]]
+            if name.endswith('.patch'):
+                for filename in release.files:
+                    old_release = self.releases[project].get(name[len(filename) + 1:-6]) if name.startswith(f'{filename}.') else None
+                    if old_release is not None:
+                        return release.patch(filename, old_release)
+        filename = os.path.abspath(os.path.join(self.root, path.lstrip('/')))
+        if path == '/index.json' and not os.path.isfile(filename):
+            return json.dumps(self.index(), sort_keys=True).encode()
+        if not filename.startswith(self.root + os.sep) or not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as static_file:
+            return static_file.read()
+
+    def index(self) -> dict:
+        index = {}
+        for project, releases in self.releases.items():
+            version_path = os.path.join(self.root, project, 'version')
+            if not os.path.isfile(version_path):
+                continue
+            version, attributes = ota_release.read_version_file(version_path)
+            entry = {'version': version}
+            if attributes:
+                entry['attributes'] = attributes
+            if version in releases:
+                entry['files'] = json.loads(releases[version].manifest)['files']
+            index[project] = entry
+        return {'projects': index}
+
+    def respond(self, method, path, headers) -> (int, dict, bytes):
+        if self.auth and headers.get('authorization') != f'Basic {self.auth}':
+            return 401, {'WWW-Authenticate': 'Basic realm="ota"'}, b''
+        if method not in ('GET', 'HEAD'):
+            return 405, {'Allow': 'GET, HEAD'}, b''
+        content = self.resolve(path.split('?')[0])
+        if content is None:
+            return 404, {}, b'Not Found'
+        response_headers = {'ETag': etag_of(content), 'Accept-Ranges': 'bytes'}
+        if self.max_age is not None and path.endswith('/version'):
+            response_headers['Cache-Control'] = f'max-age={self.max_age}'
+        if response_headers['ETag'] in [etag.strip() for etag in headers.get('if-none-match', '').split(',')]:
+            return 304, response_headers, b''
+        if 'range' in headers:
+            try:
+                content_range = parse_range(headers['range'], len(content))
+            except ValueError:
+                return 400, {}, b''
+            if content_range is None:
+                return 416, {'Content-Range': f'bytes */{len(content)}'}, b''
+            start, end = content_range
+            response_headers['Content-Range'] = f'bytes {start}-{end - 1}/{len(content)}'
+            return 206, response_headers, content[start:end]
+        return 200, response_headers, content
+
+    async def handle(self, reader, writer) -> None:
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, protocol = request_line.decode().split()
+                headers = {}
+                while True:
+                    header_line = await reader.readline()
+                    if header_line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header_line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                self.request_count += 1
+                self.requests.append((method, path, headers))
+                status, response_headers, content = self.respond(method, path, headers)
+                self.statuses[status] += 1
+                keep_alive = protocol == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                response_headers['Content-Length'] = str(len(content))
+                response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+                response = f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                response += ''.join(f'{name}: {value}\r\n' for name, value in response_headers.items())
+                response = response.encode() + b'\r\n' + (content if method != 'HEAD' else b'')
+                self.bytes_sent += len(response)
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def __enter__(self):
+        started = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        def run():
+            self.loop.run_until_complete(self.start())
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+async def serve(server) -> None:
+    async with server:
+        print(f'Serving {server.root} on http://{server.host}:{server.port}')
+        await server.server.serve_forever()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Serve micropython_ota releases')
+    parser.add_argument('root', help='directory containing <project>/version and one <project>/<version> directory per release')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--user', help='require HTTP basic authentication with this user')
+    parser.add_argument('--passwd', help='require HTTP basic authentication with this password')
+    parser.add_argument('--max-age', type=int, help='Cache-Control max-age sent with the version files, controlling the polling interval of the devices')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(OtaServer(args.root, args.host, args.port, args.user, args.passwd, args.max_age)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
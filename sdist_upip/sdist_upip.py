@@ -24,15 +24,19 @@ from distutils.filelist import FileList
 from setuptools.command.sdist import sdist as _sdist
 
 
-def gzip_4k(inf, fname):
+def gzip_4k_stream(inf, outf):
     comp = zlib.compressobj(level=9, wbits=16 + 12)
+    while 1:
+        data = inf.read(1024)
+        if not data:
+            break
+        outf.write(comp.compress(data))
+    outf.write(comp.flush())
+
+
+def gzip_4k(inf, fname):
     with open(fname + ".out", "wb") as outf:
-        while 1:
-            data = inf.read(1024)
-            if not data:
-                break
-            outf.write(comp.compress(data))
-        outf.write(comp.flush())
+        gzip_4k_stream(inf, outf)
     os.rename(fname, fname + ".orig")
     os.rename(fname + ".out", fname)
 
@@ -0,0 +1,29 @@
+import io
+import zlib
+
+AUTO = 0
+RAW = 1
+ZLIB = 2
+GZIP = 3
+
+
+class DeflateIO:
+    def __init__(self, stream, format=AUTO, wbits=0, close=False):
+        if not isinstance(stream, io.IOBase):
+            raise OSError('stream operation not supported')
+        self.stream = stream
+        wbits = wbits or 15
+        self.decompressor = zlib.decompressobj({AUTO: 32 + wbits, RAW: -wbits, ZLIB: wbits, GZIP: 16 + wbits}[format])
+        self.input = bytearray(64)
+        self.pending = b''
+
+    def readinto(self, buffer):
+        while not self.pending and not self.decompressor.eof:
+            bytes_read = self.stream.readinto(self.input)
+            self.pending = self.decompressor.decompress(self.input[:bytes_read]) if bytes_read else self.decompressor.flush()
+            if not bytes_read:
+                break
+        bytes_read = min(len(buffer), len(self.pending))
+        buffer[:bytes_read] = self.pending[:bytes_read]
+        self.pending = self.pending[bytes_read:]
+        return bytes_read
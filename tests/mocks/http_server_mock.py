@@ -0,0 +1,96 @@
+import asyncio
+import http.server
+import threading
+
+
+class MockedHttpServer:
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+        self.max_concurrent_requests = 0
+        self.concurrent_requests = 0
+        self.server = None
+        self.port = None
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *args):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.concurrent_requests += 1
+        self.max_concurrent_requests = max(self.max_concurrent_requests, self.concurrent_requests)
+        try:
+            path = (await reader.readline()).split()[1].decode()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode().partition(':')
+                headers[name.strip()] = value.strip()
+            self.requests.append((path, headers))
+            await asyncio.sleep(0.01)
+            if path not in self.files:
+                writer.write(b'HTTP/1.0 404 Not Found\r\nContent-Length: 9\r\n\r\nNot Found')
+            elif 'Range' in headers:
+                content = self.files[path][int(headers['Range'][len('bytes='):-1]):]
+                writer.write(b'HTTP/1.0 206 Partial Content\r\nContent-Length: %d\r\n\r\n%s' % (len(content), content))
+            else:
+                content = self.files[path]
+                writer.write(b'HTTP/1.0 200 OK\r\nContent-Length: %d\r\nETag: "%d"\r\n\r\n%s' % (len(content), len(content), content))
+            await writer.drain()
+        finally:
+            self.concurrent_requests -= 1
+            writer.close()
+
+
+class MockedKeepAliveServer:
+    def __init__(self, files, chunked=False, close_after_response=False):
+        self.files = files
+        self.requests = []
+        self.connections = 0
+        mocked_server = self
+
+        class RequestHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                mocked_server.connections += 1
+
+            def do_GET(self):
+                mocked_server.requests.append((self.path, dict(self.headers)))
+                content = mocked_server.files.get(self.path)
+                self.send_response(200 if content is not None else 404)
+                content = content if content is not None else b'Not Found'
+                if chunked:
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    for offset in range(0, len(content), 7):
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(content[offset:offset + 7]), content[offset:offset + 7]))
+                    self.wfile.write(b'0\r\n\r\n')
+                else:
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                self.close_connection = close_after_response
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,6 +1,6 @@
-def mock_check_version_true(host, project, auth, timeout):
+def mock_check_version_true(host, project, auth, timeout, session=None, details=None, observer=None):
     return True, 'v1.0.1'
 
 
-def mock_check_version_false(host, project, auth, timeout):
+def mock_check_version_false(host, project, auth, timeout, session=None, details=None, observer=None):
     return False, 'v1.0.1'
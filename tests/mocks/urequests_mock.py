@@ -1,8 +1,27 @@
+import http.client
+import io
+import zlib
+
+
+def gzip_4k(content) -> bytes:
+    compressor = zlib.compressobj(level=9, wbits=16 + 12)
+    return compressor.compress(content) + compressor.flush()
+
+
+NOT_FOUND = '<html><head><title>404 Not Found</title></head><body><center><h1>404 Not Found</h1></center><hr><center>nginx/1.23.0</center></body></html>'
+
+
 class MockedResponse:
     def __init__(self, url):
         self.url = url
-        self.status_code = MockedUrls[url][0]
-        self.text = MockedUrls[url][1]
+        self.status_code, content = MockedUrls.get(url, (404, NOT_FOUND))
+        self.content = content if isinstance(content, bytes) else content.encode()
+        self.headers = MockedHeaders.get(url, {})
+        self.raw = io.BytesIO(self.content)
+
+    @property
+    def text(self):
+        return self.content.decode()
 
     def close(self):
         pass
@@ -11,18 +30,104 @@ class MockedResponse:
 MockedUrls = {
     'http://example.org/sample/version': (200, 'v1.0.1'),
     'http://example.org/non_existing/version': (404, '<html><head><title>404 Not Found</title></head><body><center><h1>404 Not Found</h1></center><hr><center>nginx/1.23.0</center></body></html>'),
+    'http://example.org/cached/version': (200, 'v1.0.2'),
+    'http://example.org/polled/version': (200, 'v1.0.3\npoll_interval=600\n'),
     'http://example.org/sample/v1.0.1_main.py': (200, 'print("Hello World")'),
     'http://example.org/sample/v1.0.1_library.py': (200, 'print("This is a library")'),
+    'http://example.org/sample/v1.0.1_main.py.gz': (200, gzip_4k(b'print("Hello compressed World")')),
+    'http://example.org/sample/v1.0.1_library.py.gz': (404, '<html><head><title>404 Not Found</title></head><body><center><h1>404 Not Found</h1></center><hr><center>nginx/1.23.0</center></body></html>'),
+    'http://example.org/sample/v1.0.1/main.py.gz': (404, '<html><head><title>404 Not Found</title></head><body><center><h1>404 Not Found</h1></center><hr><center>nginx/1.23.0</center></body></html>'),
+    'http://example.org/sample/v1.0.1/library.py.gz': (404, '<html><head><title>404 Not Found</title></head><body><center><h1>404 Not Found</h1></center><hr><center>nginx/1.23.0</center></body></html>'),
+    'http://example.org/encoded/v1.0.1_main.py': (200, gzip_4k(b'print("Hello encoded World")')),
+    'http://example.org/sample/v1.0.1_main.py.sha256': (200, 'eed9979879be4d18c16286d9439a2fc7d8744bb887d78bd2987e7fbadeb84a57  main.py\n'),
+    'http://example.org/sample/v1.0.1_library.py.sha256': (200, '936c372dccc21e7dc3c27141f1678a1930c7939a4afdfb4e06d92e2357a00fae  library.py\n'),
+    'http://example.org/unsigned/v1.0.1_main.py': (200, 'print("Hello World")'),
+    'http://example.org/corrupted/v1.0.1_manifest.json': (200, '{"files": {"main.py": {"size": 20, "sha256": "eed9979879be4d18c16286d9439a2fc7d8744bb887d78bd2987e7fbadeb84a57"}, "library.py": {"size": 26, "sha256": "0000000000000000000000000000000000000000000000000000000000000000"}}}'),
+    'http://example.org/corrupted/v1.0.1_main.py': (200, 'print("Hello World")'),
+    'http://example.org/corrupted/v1.0.1_library.py': (200, 'print("This is a library")'),
+    'http://example.org/sample/v1.0.1_manifest.json': (200, '{"files": {"main.py": {"size": 20, "sha256": "eed9979879be4d18c16286d9439a2fc7d8744bb887d78bd2987e7fbadeb84a57"}, "library.py": {"size": 26, "sha256": "936c372dccc21e7dc3c27141f1678a1930c7939a4afdfb4e06d92e2357a00fae"}}}'),
+    'http://example.org/sample/v1.0.1/manifest.json': (404, '<html><head><title>404 Not Found</title></head><body><center><h1>404 Not Found</h1></center><hr><center>nginx/1.23.0</center></body></html>'),
     'http://example.org/sample/v1.0.1/main.py': (200, 'print("Hello Universe")'),
     'http://example.org/sample/v1.0.1/library.py': (200, 'print("This is a very nice library")'),
+    'http://example.org/non_existing/v1.0.1.tar': (404, '<html><head><title>404 Not Found</title></head><body><center><h1>404 Not Found</h1></center><hr><center>nginx/1.23.0</center></body></html>'),
     'http://example.org/non_existing/v1.0.1_main.py': (404, '<html><head><title>404 Not Found</title></head><body><center><h1>404 Not Found</h1></center><hr><center>nginx/1.23.0</center></body></html>'),
     'http://example.org/non_existing/v1.0.1_library.py': (404, '<html><head><title>404 Not Found</title></head><body><center><h1>404 Not Found</h1></center><hr><center>nginx/1.23.0</center></body></html>')
 }
 
 
+class LocalResponse:
+    def __init__(self, url, headers=None):
+        host, _, path = url[len('http://'):].partition('/')
+        connection = http.client.HTTPConnection(host, timeout=5)
+        connection.request('GET', f'/{path}', headers=headers or {})
+        response = connection.getresponse()
+        self.status_code = response.status
+        self.headers = dict(response.getheaders())
+        self.raw = io.BytesIO(response.read())
+        connection.close()
+
+    @property
+    def text(self):
+        return self.raw.getvalue().decode()
+
+    def close(self):
+        pass
+
+
+class MockedStreamingResponse:
+    def __init__(self, content):
+        self.status_code = 200
+        self.raw = io.BytesIO(content)
+
+    @property
+    def text(self):
+        raise MemoryError('Response body must be streamed')
+
+    def close(self):
+        pass
+
+MockedHeaders = {
+    'http://example.org/polled/version': {'Cache-Control': 'public, max-age=120'},
+    'http://example.org/cached/version': {'ETag': '"5e1f-v102"', 'Last-Modified': 'Sat, 17 Oct 2026 10:00:00 GMT'},
+    'http://example.org/encoded/v1.0.1_main.py': {'Content-Encoding': 'gzip'}
+}
+
+
 def mock_get(url, params={}, **kwargs):
     return MockedResponse(url)
 
 
+def mock_get_not_modified(url, params={}, **kwargs):
+    if 'If-None-Match' in kwargs.get('headers', {}):
+        response = MockedResponse(url)
+        response.status_code = 304
+        response.raw = io.BytesIO()
+        return response
+    return MockedResponse(url)
+
+
+def mock_get_range(url, params={}, **kwargs):
+    response = MockedResponse(url)
+    range_header = kwargs.get('headers', {}).get('Range')
+    if range_header:
+        response.status_code = 206
+        response.raw.seek(int(range_header[len('bytes='):-1]))
+    return response
+
+
 def mock_get_OSError(url, params={}, **kwargs):
     raise OSError('No route to host')
+
+
+def mock_get_mirrors(url, params={}, **kwargs):
+    if url.startswith('http://down.example.org/'):
+        raise OSError('No route to host')
+    if url == 'http://mirror.example.org/sample/v1.0.1_library.py':
+        return MockedResponse('http://mirror.example.org/missing')
+    return MockedResponse(url.replace('http://mirror.example.org/', 'http://example.org/'))
+
+
+def mock_get_local(url, params={}, **kwargs):
+    if url.startswith('http://127.0.0.1:'):
+        return LocalResponse(url, kwargs.get('headers'))
+    return MockedResponse(url)
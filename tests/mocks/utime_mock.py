@@ -0,0 +1,34 @@
+elapsed_ms = 0
+
+
+def ticks_ms():
+    return elapsed_ms
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
+
+
+def advance(ms):
+    global elapsed_ms
+    elapsed_ms += ms
+
+
+def sleep_ms(ms):
+    __import__('time').sleep(ms / 1000)
+    advance(ms)
+
+
+unix_time = 1791000000
+
+
+def time():
+    return unix_time
+
+
+def gmtime(secs=None):
+    return __import__('time').gmtime(unix_time if secs is None else secs)
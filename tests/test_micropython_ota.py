@@ -1,5 +1,15 @@
+import asyncio
+import hashlib
+import io
+import json
 import os
+import shutil
+import socket
+import struct
 import sys
+import tarfile
+import tempfile
+import threading
 import unittest
 from unittest.mock import Mock, patch
 
@@ -7,17 +17,44 @@ sys.modules['machine'] = Mock()
 sys.modules['urequests'] = Mock()
 sys.modules['uos'] = __import__('os')
 sys.modules['ubinascii'] = __import__('binascii')
+sys.modules['uhashlib'] = __import__('hashlib')
+sys.modules['ujson'] = __import__('json')
+sys.modules['uasyncio'] = __import__('asyncio')
+sys.modules['usocket'] = __import__('socket')
+sys.modules['urandom'] = __import__('random')
+from mocks import deflate_mock, http_server_mock, micropython_ota_mock, urequests_mock, utime_mock
+sys.modules['deflate'] = deflate_mock
+sys.modules['utime'] = utime_mock
 import micropython_ota
-from mocks import micropython_ota_mock, urequests_mock
+import micropython_ota_async
+import micropython_ota_http
+import micropython_ota_peer
+sys.path.append('./ota_server')
+import ota_server
+
+
+def build_tar(files) -> bytes:
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w', format=tarfile.USTAR_FORMAT) as tar:
+        for filename, content in files.items():
+            info = tarfile.TarInfo(filename)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return tar_buffer.getvalue()
 
 
 class TestMicropythonOTA(unittest.TestCase):
     def tearDown(self) -> None:
-        for filename in ['version', 'main.py', 'library.py']:
+        for filename in ['version', 'version_validators', 'main.py', 'library.py', 'evil.py', 'manifest.json', 'old.py', 'slots.json', 'mirrors.json', 'last_check',
+                         'projects.json', 'projects_index.json']:
             try:
                 os.remove(filename)
             except OSError:
                 pass
+        for directory in ['lib', 'tmp', 'slot_a', 'slot_b']:
+            shutil.rmtree(directory, ignore_errors=True)
+            if directory in sys.path:
+                sys.path.remove(directory)
 
     @patch(
         'urequests.get', urequests_mock.mock_get
@@ -72,6 +109,28 @@ class TestMicropythonOTA(unittest.TestCase):
         self.assertFalse(version_changed)
         self.assertEqual(remote_version, 'v1.0.0')
 
+    def test_check_version_persists_validators_and_sends_conditional_request(self):
+        with open('version', 'w') as current_version_file:
+            current_version_file.write('v1.0.1')
+        with patch('urequests.get', side_effect=urequests_mock.mock_get_not_modified) as urequests_call:
+            self.assertEqual(micropython_ota.check_version('http://example.org', 'cached'), (True, 'v1.0.2'))
+            self.assertEqual(micropython_ota.check_version('http://example.org', 'cached'), (True, 'v1.0.2'))
+        urequests_call.assert_called_with('http://example.org/cached/version', headers={
+            'If-None-Match': '"5e1f-v102"', 'If-Modified-Since': 'Sat, 17 Oct 2026 10:00:00 GMT'
+        }, timeout=5)
+        with open('version', 'w') as current_version_file:
+            current_version_file.write('v1.0.2')
+        with patch('urequests.get', urequests_mock.mock_get_not_modified):
+            self.assertEqual(micropython_ota.check_version('http://example.org', 'cached'), (False, 'v1.0.2'))
+
+    def test_check_version_without_validators_removes_persisted_validators(self):
+        with open('version_validators', 'w') as validators_file:
+            json.dump({'http://example.org/sample/version': {'version': 'v1.0.0', 'etag': '"outdated"', 'last_modified': None}}, validators_file)
+        with patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call:
+            micropython_ota.check_version('http://example.org', 'sample')
+        urequests_call.assert_called_with('http://example.org/sample/version', headers={'If-None-Match': '"outdated"'}, timeout=5)
+        self.assertFalse('version_validators' in os.listdir())
+
     @patch(
         'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
     )
@@ -151,6 +210,468 @@ class TestMicropythonOTA(unittest.TestCase):
         machine_hard_reset_call.assert_not_called()
         machine_soft_reset_call.assert_not_called()
 
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_streams_file_in_chunks(self):
+        content = bytes(range(256)) * 64
+        with patch('urequests.get') as urequests_call:
+            urequests_call.side_effect = lambda url, **kwargs: urequests_mock.MockedStreamingResponse(content)
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, chunk_size=100)
+        with open('main.py', 'rb') as source_file:
+            self.assertEqual(source_file.read(), content)
+        self.assertFalse('tmp' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_manifest_downloads_changed_files_only(self):
+        remote_manifest = json.loads(urequests_mock.MockedUrls['http://example.org/sample/v1.0.1_manifest.json'][1])
+        with open('manifest.json', 'w') as manifest_file:
+            json.dump({'files': {
+                'main.py': remote_manifest['files']['main.py'],
+                'library.py': {'size': 1, 'sha256': '00'},
+                'old.py': {'size': 1, 'sha256': '00'}
+            }}, manifest_file)
+        for filename in ['main.py', 'library.py', 'old.py']:
+            with open(filename, 'w') as source_file:
+                source_file.write('old')
+        with patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, use_manifest=True)
+        self.assertEqual([call.args[0] for call in urequests_call.call_args_list],
+                         ['http://example.org/sample/v1.0.1_manifest.json', 'http://example.org/sample/v1.0.1_library.py'])
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'old')
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a library")')
+        self.assertFalse('old.py' in os.listdir())
+        with open('manifest.json', 'r') as manifest_file:
+            self.assertEqual(json.load(manifest_file), remote_manifest)
+        with open('version', 'r') as current_version_file:
+            self.assertEqual(current_version_file.readline(), 'v1.0.1')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_with_manifest_not_found_updates_all_files(self):
+        with open('manifest.json', 'w') as manifest_file:
+            json.dump({'files': {}}, manifest_file)
+        micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'], use_version_prefix=False, hard_reset_device=False, use_manifest=True)
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello Universe")')
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a very nice library")')
+        self.assertFalse('manifest.json' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_tar_gz_bundle(self):
+        files = {'main.py': b'print("Hello Bundle")', 'lib/library.py': bytes(range(256)) * 40}
+        with patch('urequests.get') as urequests_call:
+            urequests_call.return_value = urequests_mock.MockedStreamingResponse(urequests_mock.gzip_4k(build_tar(files)))
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, chunk_size=100, bundle='tar.gz')
+        urequests_call.assert_called_once_with('http://example.org/sample/v1.0.1.tar.gz', timeout=5)
+        for filename, content in files.items():
+            with open(filename, 'rb') as source_file:
+                self.assertEqual(source_file.read(), content)
+        self.assertFalse('tmp' in os.listdir())
+        with open('version', 'r') as current_version_file:
+            self.assertEqual(current_version_file.readline(), 'v1.0.1')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_tar_bundle(self):
+        with patch('urequests.get') as urequests_call:
+            urequests_call.return_value = urequests_mock.MockedStreamingResponse(build_tar({'main.py': b'print("Hello Bundle")'}))
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, bundle='tar')
+        urequests_call.assert_called_once_with('http://example.org/sample/v1.0.1.tar', timeout=5)
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello Bundle")')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_rejects_bundle_member_outside_working_directory(self):
+        escaped_filename = os.path.abspath(os.path.join('..', 'escaped.py'))
+        for member_name in ['../escaped.py', 'lib/../../escaped.py', escaped_filename]:
+            with self.subTest(member_name=member_name):
+                try:
+                    with patch('urequests.get') as urequests_call:
+                        urequests_call.return_value = urequests_mock.MockedStreamingResponse(build_tar({'main.py': b'print("Hello Bundle")',
+                                                                                                         member_name: b'print("Escaped")'}))
+                        result = micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, bundle='tar')
+                    self.assertFalse(result['updated'])
+                    self.assertFalse(os.path.exists(escaped_filename))
+                    self.assertFalse('version' in os.listdir())
+                finally:
+                    if os.path.exists(escaped_filename):
+                        os.remove(escaped_filename)
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_manifest_rejects_bundle_member_not_in_manifest(self):
+        bundle = build_tar({'main.py': b'print("Hello World")', 'library.py': b'print("This is a library")', 'evil.py': b'print("Hello Evil")'})
+
+        def mock_get(url, **kwargs):
+            return urequests_mock.MockedStreamingResponse(bundle) if url.endswith('.tar') else urequests_mock.MockedResponse(url)
+
+        with patch('urequests.get', side_effect=mock_get):
+            result = micropython_ota.ota_update('http://example.org', 'sample', [], hard_reset_device=False, use_manifest=True, bundle='tar')
+        self.assertFalse(result['updated'])
+        self.assertFalse('evil.py' in os.listdir())
+        self.assertFalse('main.py' in os.listdir())
+        self.assertFalse('version' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_manifest_fails_on_bundle_missing_manifest_file(self):
+        bundle = build_tar({'main.py': b'print("Hello World")'})
+
+        def mock_get(url, **kwargs):
+            return urequests_mock.MockedStreamingResponse(bundle) if url.endswith('.tar') else urequests_mock.MockedResponse(url)
+
+        with patch('urequests.get', side_effect=mock_get):
+            result = micropython_ota.ota_update('http://example.org', 'sample', [], hard_reset_device=False, use_manifest=True, bundle='tar')
+        self.assertFalse(result['updated'])
+        self.assertEqual(result['files']['v1.0.1.tar']['status'], 200)
+        self.assertFalse('main.py' in os.listdir())
+        self.assertFalse('manifest.json' in os.listdir())
+        self.assertFalse('version' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_bundle_not_found(self):
+        micropython_ota.ota_update('http://example.org', 'non_existing', ['main.py'], bundle='tar')
+        self.assertFalse('version' in os.listdir())
+        self.assertFalse('main.py' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_compression(self):
+        with patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'], hard_reset_device=False, chunk_size=16, use_compression=True)
+        self.assertEqual([call.args[0] for call in urequests_call.call_args_list], [
+            'http://example.org/sample/v1.0.1_main.py.gz', 'http://example.org/sample/v1.0.1_library.py.gz', 'http://example.org/sample/v1.0.1_library.py'
+        ])
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello compressed World")')
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a library")')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_with_content_encoding_gzip(self):
+        micropython_ota.ota_update('http://example.org', 'encoded', ['main.py'], hard_reset_device=False)
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello encoded World")')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_keeps_truncated_download_for_resume(self):
+        content = bytes(range(100))
+        truncated_response = urequests_mock.MockedStreamingResponse(content[:40])
+        truncated_response.headers = {'Content-Length': '100'}
+        with patch('urequests.get', return_value=truncated_response):
+            result = micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False)
+        self.assertFalse(result['updated'])
+        self.assertFalse('main.py' in os.listdir())
+        self.assertEqual(os.path.getsize('tmp/main.py'), 40)
+        with open('tmp/journal', 'r') as journal_file:
+            self.assertEqual(json.load(journal_file)['done'], [])
+        remaining_response = urequests_mock.MockedStreamingResponse(content[40:])
+        remaining_response.status_code = 206
+        remaining_response.headers = {'Content-Length': '60', 'Content-Range': 'bytes 40-99/100'}
+        with patch('urequests.get', return_value=remaining_response) as urequests_call:
+            result = micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False)
+        urequests_call.assert_called_once_with('http://example.org/sample/v1.0.1_main.py', headers={'Range': 'bytes=40-'}, timeout=5)
+        self.assertTrue(result['updated'])
+        with open('main.py', 'rb') as source_file:
+            self.assertEqual(source_file.read(), content)
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_resumes_interrupted_download(self):
+        os.mkdir('tmp')
+        with open('tmp/journal', 'w') as journal_file:
+            json.dump({'version': 'v1.0.1', 'done': ['main.py']}, journal_file)
+        with open('tmp/main.py', 'w') as source_file:
+            source_file.write('print("Hello World")')
+        with open('tmp/library.py', 'w') as source_file:
+            source_file.write('print("This')
+        with patch('urequests.get', side_effect=urequests_mock.mock_get_range) as urequests_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'], hard_reset_device=False)
+        urequests_call.assert_called_once_with('http://example.org/sample/v1.0.1_library.py', headers={'Range': 'bytes=11-'}, timeout=5)
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello World")')
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a library")')
+        self.assertFalse('tmp' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_discards_partial_download_of_other_version(self):
+        os.mkdir('tmp')
+        with open('tmp/journal', 'w') as journal_file:
+            json.dump({'version': 'v1.0.0', 'done': ['main.py']}, journal_file)
+        with open('tmp/main.py', 'w') as source_file:
+            source_file.write('print("Outdated")')
+        with open('tmp/library.py', 'w') as source_file:
+            source_file.write('print("Outdated')
+        with patch('urequests.get', side_effect=urequests_mock.mock_get_range) as urequests_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'], hard_reset_device=False)
+        self.assertEqual([call.kwargs for call in urequests_call.call_args_list], [{'timeout': 5}, {'timeout': 5}])
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello World")')
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a library")')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_keeps_journal_on_failed_download(self):
+        micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'missing.py'])
+        with open('tmp/journal', 'r') as journal_file:
+            self.assertEqual(json.load(journal_file), {'version': 'v1.0.1', 'done': ['main.py']})
+        self.assertFalse('version' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_installs_files_by_renaming(self):
+        with open('main.py', 'w') as source_file:
+            source_file.write('old')
+        with patch('micropython_ota._copy_file') as copy_file_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'], hard_reset_device=False)
+        copy_file_call.assert_not_called()
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello World")')
+        self.assertFalse('tmp' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_false
+    )
+    def test_ota_update_completes_interrupted_installation(self):
+        os.mkdir('tmp')
+        with open('tmp/journal', 'w') as journal_file:
+            json.dump({'version': 'v1.0.1', 'done': ['main.py', 'library.py'], 'commit': True, 'files': ['main.py', 'library.py'], 'removed': ['old.py'],
+                       'manifest': None, 'slot': None}, journal_file)
+        with open('tmp/library.py', 'w') as source_file:
+            source_file.write('print("This is a library")')
+        for filename in ['main.py', 'old.py']:
+            with open(filename, 'w') as source_file:
+                source_file.write('print("Already installed")')
+        with patch('machine.reset') as machine_reset_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'])
+        machine_reset_call.assert_not_called()
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a library")')
+        with open('version', 'r') as current_version_file:
+            self.assertEqual(current_version_file.readline(), 'v1.0.1')
+        self.assertFalse('old.py' in os.listdir())
+        self.assertFalse('tmp' in os.listdir())
+
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_with_slots_and_rollback(self):
+        with patch('micropython_ota.check_version', micropython_ota_mock.mock_check_version_true):
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, use_slots=True)
+        self.assertEqual(micropython_ota.activate_slot(), 'slot_a')
+        self.assertEqual(sys.path[0], 'slot_a')
+        micropython_ota.mark_healthy()
+        with open('slot_a/main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello World")')
+        self.assertFalse('main.py' in os.listdir())
+
+        with patch('micropython_ota.check_version', return_value=(True, 'v1.0.2')), patch('urequests.get') as urequests_call:
+            urequests_call.return_value = urequests_mock.MockedStreamingResponse(b'print("Broken")')
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, use_slots=True)
+        with open('slot_b/main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Broken")')
+        self.assertEqual(micropython_ota.activate_slot(max_boot_attempts=1), 'slot_b')
+        self.assertEqual(micropython_ota.activate_slot(max_boot_attempts=1), 'slot_a')
+        with open('version', 'r') as current_version_file:
+            self.assertEqual(current_version_file.readline(), 'v1.0.1')
+        with open('slots.json', 'r') as slot_state_file:
+            self.assertEqual(json.load(slot_state_file)['failed_version'], 'v1.0.2')
+
+        self.assertEqual(micropython_ota.check_version('http://example.org', 'cached'), (False, 'v1.0.2'))
+
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_with_slots_completes_commit_interrupted_after_slot_switch(self):
+        with patch('micropython_ota.check_version', micropython_ota_mock.mock_check_version_true):
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, use_slots=True)
+        micropython_ota.activate_slot()
+        micropython_ota.mark_healthy()
+        write_slot_state = micropython_ota._write_slot_state
+
+        def write_slot_state_and_lose_power(slot_state):
+            write_slot_state(slot_state)
+            raise OSError('Power lost')
+
+        with patch('micropython_ota.check_version', return_value=(True, 'v1.0.2')), patch('urequests.get') as urequests_call, \
+                patch('micropython_ota._write_slot_state', write_slot_state_and_lose_power):
+            urequests_call.return_value = urequests_mock.MockedStreamingResponse(b'print("Hello v1.0.2")')
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, use_slots=True)
+        with open('version', 'r') as current_version_file:
+            self.assertEqual(current_version_file.readline(), 'v1.0.1')
+        with patch('micropython_ota.check_version', micropython_ota_mock.mock_check_version_false):
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, use_slots=True)
+        with open('version', 'r') as current_version_file:
+            self.assertEqual(current_version_file.readline(), 'v1.0.2')
+        with open('slots.json', 'r') as slot_state_file:
+            slot_state = json.load(slot_state_file)
+        self.assertEqual((slot_state['active'], slot_state['previous']), ('slot_b', 'slot_a'))
+        self.assertEqual(micropython_ota.activate_slot(max_boot_attempts=1), 'slot_b')
+        self.assertEqual(micropython_ota.activate_slot(max_boot_attempts=1), 'slot_a')
+        self.assertFalse('tmp' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_with_manifest_checksum_mismatch(self):
+        with open('main.py', 'w') as source_file:
+            source_file.write('print("Current version")')
+        with patch('machine.reset') as machine_reset_call:
+            micropython_ota.ota_update('http://example.org', 'corrupted', ['main.py', 'library.py'], use_manifest=True)
+        machine_reset_call.assert_not_called()
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Current version")')
+        self.assertFalse('version' in os.listdir())
+        self.assertFalse('library.py' in os.listdir('tmp'))
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_checksum_files(self):
+        with patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, verify_hash=True)
+        self.assertEqual([call.args[0] for call in urequests_call.call_args_list],
+                         ['http://example.org/sample/v1.0.1_main.py.sha256', 'http://example.org/sample/v1.0.1_main.py'])
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello World")')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_with_checksum_file_not_found(self):
+        micropython_ota.ota_update('http://example.org', 'unsigned', ['main.py'], verify_hash=True)
+        self.assertFalse('version' in os.listdir())
+        self.assertFalse('main.py' in os.listdir())
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get_range
+    )
+    def test_ota_update_verifies_checksum_of_resumed_download(self):
+        os.mkdir('tmp')
+        with open('tmp/journal', 'w') as journal_file:
+            json.dump({'version': 'v1.0.1', 'done': []}, journal_file)
+        with open('tmp/library.py', 'w') as source_file:
+            source_file.write('print("This')
+        micropython_ota.ota_update('http://example.org', 'sample', ['library.py'], hard_reset_device=False, verify_hash=True)
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a library")')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_patches(self):
+        with open('version', 'w') as current_version_file:
+            current_version_file.write('v1.0.0')
+        for filename in ['main.py', 'library.py']:
+            with open(filename, 'w') as source_file:
+                source_file.write('print("Hello Universe")')
+        patches = {
+            'http://example.org/sample/v1.0.1_main.py.v1.0.0.patch': b'OTAP\x01C' + struct.pack('>II', 0, 13) + b'I' + struct.pack('>I', 7) + b'World")E',
+            'http://example.org/sample/v1.0.1_library.py.v1.0.0.patch': b'OTAP\x01C' + struct.pack('>II', 0, 7) + b'I' + struct.pack('>I', 3) + b'BadE'
+        }
+
+        def mock_get(url, **kwargs):
+            if url in patches:
+                return urequests_mock.MockedStreamingResponse(patches[url])
+            return urequests_mock.mock_get(url, **kwargs)
+
+        with patch('urequests.get', side_effect=mock_get) as urequests_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'], hard_reset_device=False, chunk_size=4, verify_hash=True,
+                                       use_patches=True)
+        self.assertEqual([call.args[0] for call in urequests_call.call_args_list], [
+            'http://example.org/sample/v1.0.1_main.py.sha256', 'http://example.org/sample/v1.0.1_main.py.v1.0.0.patch',
+            'http://example.org/sample/v1.0.1_library.py.sha256', 'http://example.org/sample/v1.0.1_library.py.v1.0.0.patch',
+            'http://example.org/sample/v1.0.1_library.py'
+        ])
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello World")')
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a library")')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_patch_not_found(self):
+        with open('version', 'w') as current_version_file:
+            current_version_file.write('v1.0.0')
+        with open('main.py', 'w') as source_file:
+            source_file.write('print("Hello Universe")')
+        with patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'], hard_reset_device=False, verify_hash=True,
+                                       use_patches=True)
+        self.assertEqual([call.args[0] for call in urequests_call.call_args_list], [
+            'http://example.org/sample/v1.0.1_main.py.sha256', 'http://example.org/sample/v1.0.1_main.py.v1.0.0.patch',
+            'http://example.org/sample/v1.0.1_main.py', 'http://example.org/sample/v1.0.1_library.py.sha256', 'http://example.org/sample/v1.0.1_library.py'
+        ])
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello World")')
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_patches_without_checksum(self):
+        with open('version', 'w') as current_version_file:
+            current_version_file.write('v1.0.0')
+        with open('main.py', 'w') as source_file:
+            source_file.write('print("Locally edited")')
+        with patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call:
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], hard_reset_device=False, use_patches=True)
+        self.assertEqual([call.args[0] for call in urequests_call.call_args_list], ['http://example.org/sample/v1.0.1_main.py'])
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello World")')
+
     @patch(
         'micropython_ota.check_version', micropython_ota_mock.mock_check_version_false
     )
@@ -216,6 +737,595 @@ class TestMicropythonOTA(unittest.TestCase):
             machine_reset_call.assert_not_called()
             machine_soft_reset_call.assert_not_called()
 
+    def test_check_version_async(self):
+        async def check_version_async():
+            async with http_server_mock.MockedHttpServer({'/sample/version': b'v1.0.1\n'}) as server:
+                result = await micropython_ota_async.check_version_async(f'http://127.0.0.1:{server.port}', 'sample', auth='aGVsbG86d29ybGQ=')
+            return result, server.requests, server.port
+
+        (version_changed, remote_version), requests, port = asyncio.run(check_version_async())
+        self.assertTrue(version_changed)
+        self.assertEqual(remote_version, 'v1.0.1')
+        self.assertEqual(requests[0][1]['Authorization'], 'Basic aGVsbG86d29ybGQ=')
+        with open('version_validators', 'r') as validators_file:
+            self.assertEqual(json.load(validators_file)[f'http://127.0.0.1:{port}/sample/version']['etag'], '"7"')
+
+    def test_ota_update_async_downloads_files_concurrently(self):
+        files = {
+            '/sample/version': b'v1.0.1',
+            '/sample/v1.0.1_main.py': b'print("Hello World")',
+            '/sample/v1.0.1_library.py': b'print("This is a library")',
+            '/sample/v1.0.1_old.py': bytes(range(256)) * 20
+        }
+
+        async def ota_update_async():
+            async with http_server_mock.MockedHttpServer(files) as server:
+                await micropython_ota_async.ota_update_async(f'http://127.0.0.1:{server.port}', 'sample', ['main.py', 'library.py', 'old.py'],
+                                                       hard_reset_device=False, chunk_size=64, max_concurrency=3)
+            return server
+
+        server = asyncio.run(ota_update_async())
+        self.assertEqual(server.max_concurrent_requests, 3)
+        for filename in ['main.py', 'library.py', 'old.py']:
+            with open(filename, 'rb') as source_file:
+                self.assertEqual(source_file.read(), files[f'/sample/v1.0.1_{filename}'])
+        with open('version', 'r') as current_version_file:
+            self.assertEqual(current_version_file.readline(), 'v1.0.1')
+        self.assertFalse('tmp' in os.listdir())
+
+    def test_ota_update_async_source_file_not_found(self):
+        async def ota_update_async():
+            async with http_server_mock.MockedHttpServer({'/sample/version': b'v1.0.1', '/sample/v1.0.1_main.py': b'print("Hello World")'}) as server:
+                await micropython_ota_async.ota_update_async(f'http://127.0.0.1:{server.port}', 'sample', ['main.py', 'library.py'])
+
+        with patch('machine.reset') as machine_reset_call:
+            asyncio.run(ota_update_async())
+        machine_reset_call.assert_not_called()
+        self.assertFalse('version' in os.listdir())
+        self.assertFalse('main.py' in os.listdir())
+
+    def test_ota_update_with_keep_alive_reuses_connection(self):
+        files = {'/sample/version': b'v1.0.1', '/sample/v1.0.1_main.py': b'print("Hello World")', '/sample/v1.0.1_library.py': b'print("This is a library")'}
+        with http_server_mock.MockedKeepAliveServer(files) as server:
+            micropython_ota.ota_update(f'http://127.0.0.1:{server.port}', 'sample', ['main.py', 'library.py'], user='hello', passwd='world',
+                                       hard_reset_device=False, keep_alive=True)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual([path for path, _ in server.requests], ['/sample/version', '/sample/v1.0.1_main.py', '/sample/v1.0.1_library.py'])
+        self.assertTrue(all(headers['Authorization'] == 'Basic aGVsbG86d29ybGQ=' for _, headers in server.requests))
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a library")')
+
+    def test_http_session_decodes_chunked_responses(self):
+        content = bytes(range(256)) * 3
+        with http_server_mock.MockedKeepAliveServer({'/sample/data.bin': content, '/sample/version': b'v1.0.1'}, chunked=True) as server:
+            session = micropython_ota_http.HttpSession(f'http://127.0.0.1:{server.port}')
+            response = session.get(f'http://127.0.0.1:{server.port}/sample/data.bin')
+            self.assertEqual(response.status_code, 200)
+            buffer = bytearray(50)
+            received = b''
+            while bytes_read := response.raw.readinto(buffer):
+                received += buffer[:bytes_read]
+            self.assertEqual(received, content)
+            response.close()
+            response = session.get(f'http://127.0.0.1:{server.port}/sample/version')
+            self.assertEqual(response.text, 'v1.0.1')
+            response.close()
+            session.close()
+        self.assertEqual(server.connections, 1)
+
+    def test_http_session_reconnects_when_server_closed_connection(self):
+        with http_server_mock.MockedKeepAliveServer({'/sample/version': b'v1.0.1'}, close_after_response=True) as server:
+            session = micropython_ota_http.HttpSession(f'http://127.0.0.1:{server.port}')
+            for _ in range(3):
+                response = session.get(f'http://127.0.0.1:{server.port}/sample/version')
+                self.assertEqual(response.text, 'v1.0.1')
+                response.close()
+            session.close()
+        self.assertEqual(server.connections, 3)
+
+    def test_check_version_reports_details(self):
+        details = {}
+        with patch('urequests.get', side_effect=urequests_mock.mock_get):
+            version_changed, remote_version = micropython_ota.check_version('http://example.org', 'polled', details=details)
+        self.assertTrue(version_changed)
+        self.assertEqual(remote_version, 'v1.0.3')
+        self.assertEqual(details, {'status': 200, 'max_age': 120, 'retry_after': None, 'attributes': {'poll_interval': '600'}, 'duration_ms': 0})
+
+    @patch(
+        'urandom.getrandbits', Mock(return_value=65535)
+    )
+    def test_scheduler_uses_server_interval_and_backs_off_on_errors(self):
+        scheduler = micropython_ota.OtaScheduler('http://example.org', 'polled', interval=10, jitter=0.1, max_backoff=100)
+        self.assertFalse(scheduler.due())
+        utime_mock.advance(11000)
+        self.assertTrue(scheduler.due())
+        with patch('urequests.get', urequests_mock.mock_get):
+            self.assertEqual(scheduler.poll(), (True, 'v1.0.3'))
+        self.assertEqual(scheduler.interval, 600)
+        self.assertEqual(utime_mock.ticks_diff(scheduler.next_poll, utime_mock.ticks_ms()) , 660000)
+        with patch('urequests.get', urequests_mock.mock_get_OSError):
+            scheduler.interval = 10
+            scheduler.poll()
+            self.assertEqual(utime_mock.ticks_diff(scheduler.next_poll, utime_mock.ticks_ms()) , 22000)
+            scheduler.poll()
+            scheduler.poll()
+            scheduler.poll()
+            self.assertEqual(utime_mock.ticks_diff(scheduler.next_poll, utime_mock.ticks_ms()) , 110000)
+        with patch('urequests.get', urequests_mock.mock_get):
+            scheduler.poll()
+        self.assertEqual(scheduler.errors, 0)
+
+    def test_scheduler_returns_to_configured_interval(self):
+        scheduler = micropython_ota.OtaScheduler('http://example.org', 'polled', interval=10)
+        with patch('urequests.get', urequests_mock.mock_get):
+            scheduler.poll()
+            self.assertEqual(scheduler.interval, 600)
+            with patch.dict(urequests_mock.MockedUrls, {'http://example.org/polled/version': (200, 'v1.0.3')}):
+                scheduler.poll()
+                self.assertEqual(scheduler.interval, 120)
+                with patch.dict(urequests_mock.MockedHeaders, {'http://example.org/polled/version': {}}):
+                    scheduler.poll()
+        self.assertEqual(scheduler.interval, 10)
+
+    @patch(
+        'urandom.getrandbits', Mock(return_value=65535)
+    )
+    def test_scheduler_waits_for_retry_after_on_failed_check(self):
+        scheduler = micropython_ota.OtaScheduler('http://example.org', 'polled', interval=10, jitter=0.1)
+        with patch('urequests.get', urequests_mock.mock_get), \
+                patch.dict(urequests_mock.MockedUrls, {'http://example.org/polled/version': (503, 'Service Unavailable')}), \
+                patch.dict(urequests_mock.MockedHeaders, {'http://example.org/polled/version': {'Retry-After': '1800'}}):
+            scheduler.poll()
+        self.assertEqual(scheduler.errors, 1)
+        self.assertEqual(scheduler.interval, 10)
+        self.assertEqual(utime_mock.ticks_diff(scheduler.next_poll, utime_mock.ticks_ms()), 1800000)
+
+    def test_scheduler_ignores_zero_poll_interval(self):
+        scheduler = micropython_ota.OtaScheduler('http://example.org', 'polled', interval=10)
+        with patch('urequests.get', urequests_mock.mock_get), \
+                patch.dict(urequests_mock.MockedUrls, {'http://example.org/polled/version': (200, 'v1.0.3\npoll_interval=0\n')}), \
+                patch.dict(urequests_mock.MockedHeaders, {'http://example.org/polled/version': {}}):
+            scheduler.poll()
+        self.assertEqual(scheduler.interval, 10)
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_scheduler_check_for_ota_update_resets_device_when_due(self):
+        scheduler = micropython_ota.OtaScheduler('http://example.org', 'sample', interval=10, soft_reset_device=True)
+        with patch('machine.reset') as machine_hard_reset_call, patch('machine.soft_reset') as machine_soft_reset_call:
+            scheduler.check_for_ota_update()
+            machine_soft_reset_call.assert_not_called()
+            utime_mock.advance(13000)
+            scheduler.check_for_ota_update()
+            machine_soft_reset_call.assert_called_once()
+            machine_hard_reset_call.assert_not_called()
+
+    @patch(
+        'machine.unique_id', Mock(return_value=b'\x24\x0a\xc4\x12\x34\x56')
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_check_version_with_rollout_percentage(self):
+        position = int.from_bytes(hashlib.sha256(b'\x24\x0a\xc4\x12\x34\x56').digest()[:2], 'big') / 65536
+        with patch.dict(urequests_mock.MockedUrls, {'http://example.org/staged/version': (200, f'v1.0.4\nrollout={position * 100 + 1}')}):
+            self.assertEqual(micropython_ota.check_version('http://example.org', 'staged'), (True, 'v1.0.4'))
+        with patch.dict(urequests_mock.MockedUrls, {'http://example.org/staged/version': (200, f'v1.0.4\nrollout={position * 100}')}):
+            self.assertEqual(micropython_ota.check_version('http://example.org', 'staged'), (False, 'v1.0.4'))
+
+    @patch(
+        'machine.unique_id', Mock(return_value=b'\x24\x0a\xc4\x12\x34\x56')
+    )
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_check_version_with_rollout_window(self):
+        position = int.from_bytes(hashlib.sha256(b'\x24\x0a\xc4\x12\x34\x56').digest()[:2], 'big') / 65536
+        start = utime_mock.unix_time - int(position * 10000)
+        with patch.dict(urequests_mock.MockedUrls, {'http://example.org/staged/version': (200, f'v1.0.4\nrollout_start={start}\nrollout_window=10000')}):
+            self.assertEqual(micropython_ota.check_version('http://example.org', 'staged'), (False, 'v1.0.4'))
+            with patch('utime.unix_time', utime_mock.unix_time + 1):
+                self.assertEqual(micropython_ota.check_version('http://example.org', 'staged'), (True, 'v1.0.4'))
+            with patch('utime.unix_time', 1000):
+                self.assertEqual(micropython_ota.check_version('http://example.org', 'staged'), (True, 'v1.0.4'))
+
+    def test_check_mirrors_ranks_healthy_mirrors_by_latency(self):
+        latencies = {'http://a.example.org': 300, 'http://b.example.org': 50}
+
+        def mock_check_version(host, project, auth=None, timeout=5, session=None, details=None, observer=None):
+            if host not in latencies:
+                details['status'] = None
+                return False, ''
+            utime_mock.advance(latencies[host])
+            details['status'] = 200
+            return True, f'v1.0.1-{host[7]}'
+
+        hosts = ['http://a.example.org', 'http://down.example.org', 'http://b.example.org']
+        with patch('micropython_ota.check_version', side_effect=mock_check_version) as check_version_call:
+            self.assertEqual(micropython_ota._check_mirrors(hosts, 'sample'),
+                             (True, 'v1.0.1-b', ['http://b.example.org', 'http://a.example.org', 'http://down.example.org']))
+            self.assertEqual(micropython_ota._check_preferred_mirror(hosts, 'sample'), (True, 'v1.0.1-b'))
+        self.assertEqual(check_version_call.call_args_list[-1].args[0], 'http://b.example.org')
+        with open('mirrors.json', 'r') as mirrors_file:
+            self.assertEqual(json.load(mirrors_file), {'ranking': ['http://b.example.org', 'http://a.example.org', 'http://down.example.org'], 'checks': 0})
+
+    def test_check_for_ota_update_fails_over_to_next_mirror(self):
+        with patch('urequests.get', side_effect=urequests_mock.mock_get_mirrors), patch('machine.reset') as machine_reset_call:
+            micropython_ota.check_for_ota_update(['http://down.example.org', 'http://example.org'], 'sample')
+        machine_reset_call.assert_called_once()
+        with open('mirrors.json', 'r') as mirrors_file:
+            self.assertEqual(json.load(mirrors_file)['ranking'], ['http://example.org', 'http://down.example.org'])
+
+    def test_ota_update_checks_mirrors_in_stored_ranking_order(self):
+        hosts = ['http://down.example.org', 'http://mirror.example.org', 'http://example.org']
+        with open('version', 'w') as current_version_file:
+            current_version_file.write('v1.0.1')
+        with open('mirrors.json', 'w') as mirrors_file:
+            json.dump({'ranking': ['http://example.org', 'http://down.example.org', 'http://mirror.example.org'], 'checks': 0}, mirrors_file)
+        with patch('urequests.get', side_effect=urequests_mock.mock_get_mirrors) as urequests_call:
+            micropython_ota.ota_update(hosts, 'sample', ['main.py'])
+            self.assertEqual([call.args[0] for call in urequests_call.call_args_list], ['http://example.org/sample/version'])
+            with open('mirrors.json', 'w') as mirrors_file:
+                json.dump({'ranking': ['http://down.example.org', 'http://example.org', 'http://mirror.example.org'], 'checks': 1}, mirrors_file)
+            urequests_call.reset_mock()
+            micropython_ota.ota_update(hosts, 'sample', ['main.py'])
+            self.assertEqual([call.args[0] for call in urequests_call.call_args_list], ['http://down.example.org/sample/version',
+                                                                                        'http://example.org/sample/version'])
+            with open('mirrors.json', 'r') as mirrors_file:
+                self.assertEqual(json.load(mirrors_file), {'ranking': ['http://example.org', 'http://mirror.example.org', 'http://down.example.org'],
+                                                           'checks': 2})
+            with open('mirrors.json', 'w') as mirrors_file:
+                json.dump({'ranking': ['http://example.org', 'http://mirror.example.org', 'http://down.example.org'],
+                           'checks': micropython_ota._MIRROR_RANKING_INTERVAL}, mirrors_file)
+            urequests_call.reset_mock()
+            micropython_ota.ota_update(hosts, 'sample', ['main.py'])
+            self.assertEqual(len(urequests_call.call_args_list), 3)
+        with open('mirrors.json', 'r') as mirrors_file:
+            self.assertEqual(json.load(mirrors_file)['checks'], 0)
+
+    def test_ota_update_with_mirrors_fails_over_per_file(self):
+        with patch('urequests.get', side_effect=urequests_mock.mock_get_mirrors) as urequests_call, patch('machine.reset') as machine_reset_call:
+            micropython_ota.ota_update(['http://down.example.org', 'http://mirror.example.org', 'http://example.org'], 'sample', ['main.py', 'library.py'])
+        machine_reset_call.assert_called_once()
+        requested_urls = [call.args[0] for call in urequests_call.call_args_list]
+        self.assertIn('http://mirror.example.org/sample/v1.0.1_main.py', requested_urls)
+        self.assertNotIn('http://example.org/sample/v1.0.1_main.py', requested_urls)
+        self.assertNotIn('http://down.example.org/sample/v1.0.1_main.py', requested_urls)
+        self.assertIn('http://example.org/sample/v1.0.1_library.py', requested_urls)
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("Hello World")')
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.readline(), 'print("This is a library")')
+        with open('version', 'r') as version_file:
+            self.assertEqual(version_file.readline(), 'v1.0.1')
+
+    def test_ota_update_against_reference_server(self):
+        old_main_py = 'print("Hello World")\n' * 20
+        with tempfile.TemporaryDirectory() as root:
+            for version, content in [('v1.0.0', old_main_py), ('v1.0.1', old_main_py + 'print("Bye")\n')]:
+                os.makedirs(os.path.join(root, 'sample', version, 'lib'))
+                with open(os.path.join(root, 'sample', version, 'main.py'), 'w') as source_file:
+                    source_file.write(content)
+                with open(os.path.join(root, 'sample', version, 'lib', 'library.py'), 'w') as source_file:
+                    source_file.write(f'print("This is library {version}")')
+            with open(os.path.join(root, 'sample', 'version'), 'w') as version_file:
+                version_file.write('v1.0.1')
+            with open('version', 'w') as current_version_file:
+                current_version_file.write('v1.0.0')
+            with open('main.py', 'w') as source_file:
+                source_file.write(old_main_py)
+            with ota_server.OtaServer(root, port=0, user='hello', passwd='world') as server, patch('machine.reset') as machine_reset_call:
+                micropython_ota.ota_update(f'http://127.0.0.1:{server.port}', 'sample', [], user='hello', passwd='world', use_manifest=True,
+                                           use_compression=True, keep_alive=True, use_patches=True)
+        machine_reset_call.assert_called_once()
+        self.assertEqual(server.connections, 1)
+        self.assertIn('/sample/v1.0.1_main.py.v1.0.0.patch', [request[1] for request in server.requests])
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.read(), old_main_py + 'print("Bye")\n')
+        with open('lib/library.py', 'r') as source_file:
+            self.assertEqual(source_file.read(), 'print("This is library v1.0.1")')
+        with open('version', 'r') as version_file:
+            self.assertEqual(version_file.readline(), 'v1.0.1')
+
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_reports_events_and_result(self):
+        events = []
+
+        def observer(event, data):
+            events.append((event, data))
+            if event == 'download_progress':
+                utime_mock.advance(5)
+
+        with patch('machine.reset') as machine_reset_call, patch('builtins.print') as print_call:
+            result = micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py', 'missing.py'], observer=observer)
+        machine_reset_call.assert_not_called()
+        print_call.assert_not_called()
+        self.assertEqual([event for event, _ in events if event != 'log'], [
+            'version_check', 'download_start', 'download_progress', 'download_end', 'download_start', 'download_progress', 'download_end',
+            'download_start', 'download_end'
+        ])
+        self.assertEqual(events[0][1], {'host': 'http://example.org', 'status': 200, 'duration_ms': 0, 'version': 'v1.0.1', 'changed': True})
+        self.assertIn(('log', {'message': 'Remote source file http://example.org/sample/v1.0.1_missing.py not found'}), events)
+        self.assertEqual(result['current_version'], '')
+        self.assertEqual(result['remote_version'], 'v1.0.1')
+        self.assertFalse(result['updated'])
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['bytes'], 46)
+        self.assertEqual(result['duration_ms'], 10)
+        self.assertEqual(result['files']['main.py'], {'status': 200, 'bytes': 20, 'retries': 0, 'patched': False, 'mirror': 'http://example.org',
+                                                      'resumed_from': 0, 'ok': True, 'duration_ms': 5})
+        self.assertEqual(result['files']['missing.py']['status'], 404)
+        self.assertFalse(result['files']['missing.py']['ok'])
+
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_reports_result_before_reset(self):
+        events = []
+        with patch('machine.reset') as machine_reset_call:
+            result = micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'], observer=lambda event, data: events.append((event, data)))
+        machine_reset_call.assert_called_once()
+        self.assertEqual([event for event, _ in events][-4:], ['download_end', 'commit', 'reset', 'log'])
+        self.assertEqual(events[-3][1], {'version': 'v1.0.1', 'files': 2, 'removed': 0, 'duration_ms': 0})
+        self.assertEqual(events[-2][1], {'soft': False, 'result': result})
+        self.assertTrue(result['updated'])
+
+    @patch(
+        'urequests.get', urequests_mock.mock_get
+    )
+    def test_ota_update_with_binary_files(self):
+        mpy = b'M\x06\x00\x1f\x02\r\n\x00\xff\xfe\x80\x1a'
+        with patch.dict(urequests_mock.MockedUrls, {'http://example.org/sample/v1.0.1_lib/library.mpy': (200, mpy)}), patch('machine.reset'):
+            micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'lib/library.mpy'])
+        with open('lib/library.mpy', 'rb') as mpy_file:
+            self.assertEqual(mpy_file.read(), mpy)
+
+    def test_ota_update_skips_version_check_within_ttl(self):
+        with open('version', 'w') as current_version_file:
+            current_version_file.write('v1.0.1')
+        with patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call:
+            self.assertFalse(micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], check_ttl=300)['check_skipped'])
+            self.assertEqual(urequests_call.call_count, 1)
+            result = micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], check_ttl=300)
+            self.assertTrue(result['check_skipped'])
+            self.assertEqual(result['remote_version'], 'v1.0.1')
+            self.assertEqual(urequests_call.call_count, 1)
+            with patch('utime.unix_time', utime_mock.unix_time + 300):
+                self.assertFalse(micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], check_ttl=300)['check_skipped'])
+            self.assertEqual(urequests_call.call_count, 2)
+        with open('last_check', 'r') as last_check_file:
+            self.assertEqual(json.load(last_check_file), {'time': utime_mock.unix_time + 300, 'version': 'v1.0.1', 'pending': False})
+
+    def test_ota_update_does_not_skip_version_check_with_unset_clock(self):
+        with open('version', 'w') as current_version_file:
+            current_version_file.write('v1.0.1')
+        with open('last_check', 'w') as last_check_file:
+            json.dump({'time': 2, 'version': 'v1.0.1', 'pending': False}, last_check_file)
+        with patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call, patch('utime.unix_time', 4):
+            for _ in range(2):
+                self.assertFalse(micropython_ota.ota_update('http://example.org', 'sample', ['main.py'], check_ttl=300)['check_skipped'])
+        self.assertEqual(urequests_call.call_count, 2)
+        self.assertFalse('last_check' in os.listdir())
+
+    def test_ota_update_checks_within_ttl_when_update_pending(self):
+        with open('version', 'w') as current_version_file:
+            current_version_file.write('v1.0.0')
+        with open('last_check', 'w') as last_check_file:
+            json.dump({'time': utime_mock.unix_time, 'version': 'v1.0.0', 'pending': False}, last_check_file)
+        with patch('urequests.get', side_effect=urequests_mock.mock_get), patch('machine.reset') as machine_reset_call:
+            micropython_ota.check_for_ota_update('http://example.org', 'sample')
+            machine_reset_call.assert_called_once()
+            with open('last_check', 'r') as last_check_file:
+                self.assertEqual(json.load(last_check_file), {'time': utime_mock.unix_time, 'version': 'v1.0.1', 'pending': True})
+            result = micropython_ota.ota_update('http://example.org', 'sample', ['main.py', 'library.py'], check_ttl=300)
+        self.assertFalse(result['check_skipped'])
+        self.assertTrue(result['updated'])
+        with open('last_check', 'r') as last_check_file:
+            self.assertEqual(json.load(last_check_file), {'time': utime_mock.unix_time, 'version': 'v1.0.1', 'pending': False})
+
+    def test_check_projects_with_single_index_request(self):
+        with open('projects.json', 'w') as projects_file:
+            json.dump({'core': {'version': 'v1.2.0', 'manifest': None}}, projects_file)
+        index = '{"projects": {"core": {"version": "v1.2.0"}, "drivers": {"version": "v0.3.1"}}}'
+        with patch.dict(urequests_mock.MockedUrls, {'http://example.org/index.json': (200, index)}), \
+                patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call:
+            checks = micropython_ota.check_projects('http://example.org', ['core', 'drivers', 'unknown'])
+        urequests_call.assert_called_once_with('http://example.org/index.json', timeout=5)
+        self.assertEqual(checks, {'core': (False, 'v1.2.0'), 'drivers': (True, 'v0.3.1'), 'unknown': (False, '')})
+
+    def test_check_projects_ignores_failed_slot_version(self):
+        with open('slots.json', 'w') as slot_state_file:
+            json.dump({'active': 'slot_a', 'previous': None, 'pending': False, 'boot_attempts': 0, 'versions': {'slot_a': 'v1.0.0'},
+                       'failed_version': 'v1.0.1'}, slot_state_file)
+        index = '{"projects": {"drivers": {"version": "v1.0.1"}}}'
+        with patch.dict(urequests_mock.MockedUrls, {'http://example.org/index.json': (200, index)}), patch('urequests.get', urequests_mock.mock_get):
+            self.assertEqual(micropython_ota.check_projects('http://example.org', ['drivers']), {'drivers': (True, 'v1.0.1')})
+
+    def test_ota_update_projects_against_reference_server(self):
+        with tempfile.TemporaryDirectory() as root:
+            for project, version, filename, content in [('core', 'v1.2.0', 'main.py', 'print("core")'), ('drivers', 'v0.3.1', 'lib/driver.py', 'print("driver")')]:
+                os.makedirs(os.path.join(root, project, version, os.path.dirname(filename)), exist_ok=True)
+                with open(os.path.join(root, project, version, filename), 'w') as source_file:
+                    source_file.write(content)
+                with open(os.path.join(root, project, 'version'), 'w') as version_file:
+                    version_file.write(version)
+            with ota_server.OtaServer(root, port=0) as server, patch('machine.reset') as machine_reset_call:
+                result = micropython_ota.ota_update_projects(f'http://127.0.0.1:{server.port}', ['core', 'drivers'], keep_alive=True)
+                machine_reset_call.assert_called_once()
+                self.assertEqual(server.connections, 1)
+                self.assertEqual([request[1] for request in server.requests], ['/index.json', '/core/v1.2.0_main.py', '/drivers/v0.3.1_lib/driver.py'])
+                with open(os.path.join(root, 'drivers', 'version'), 'w') as version_file:
+                    version_file.write('v0.3.2')
+                os.rename(os.path.join(root, 'drivers', 'v0.3.1'), os.path.join(root, 'drivers', 'v0.3.2'))
+                with open(os.path.join(root, 'drivers', 'v0.3.2', 'lib', 'driver.py'), 'w') as source_file:
+                    source_file.write('print("driver v0.3.2")')
+                server.load()
+                second_result = micropython_ota.ota_update_projects(f'http://127.0.0.1:{server.port}', ['core', 'drivers'], keep_alive=True)
+                self.assertEqual([request[1] for request in server.requests][3:], ['/index.json', '/drivers/v0.3.2_lib/driver.py'])
+                self.assertFalse(micropython_ota.ota_update_projects(f'http://127.0.0.1:{server.port}', ['core', 'drivers'], keep_alive=True)['updated'])
+                self.assertEqual(server.requests[-1][1], '/index.json')
+                self.assertIn('if-none-match', server.requests[-1][2])
+        self.assertTrue(result['updated'])
+        self.assertEqual(result['projects']['drivers'], {'current_version': '', 'remote_version': 'v0.3.1', 'changed': True})
+        self.assertEqual(second_result['projects']['core']['changed'], False)
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.read(), 'print("core")')
+        with open('lib/driver.py', 'r') as source_file:
+            self.assertEqual(source_file.read(), 'print("driver v0.3.2")')
+        with open('projects.json', 'r') as projects_file:
+            self.assertEqual({project: state['version'] for project, state in json.load(projects_file).items()}, {'core': 'v1.2.0', 'drivers': 'v0.3.2'})
+        self.assertFalse('version' in os.listdir())
+
+    def test_ota_update_projects_keeps_file_moved_to_other_project(self):
+        releases = [{'core': {'main.py': 'print("core")', 'lib/shared.py': 'print("shared core")'}, 'drivers': {'lib/driver.py': 'print("driver")'}},
+                    {'core': {'main.py': 'print("core")'}, 'drivers': {'lib/driver.py': 'print("driver")', 'lib/shared.py': 'print("shared drivers")'}}]
+        with tempfile.TemporaryDirectory() as root:
+            with ota_server.OtaServer(root, port=0) as server, patch('urequests.get', side_effect=urequests_mock.mock_get_local), patch('machine.reset'):
+                for version, release in enumerate(releases):
+                    for project, files in release.items():
+                        for filename, content in files.items():
+                            os.makedirs(os.path.join(root, project, f'v1.{version}.0', os.path.dirname(filename)), exist_ok=True)
+                            with open(os.path.join(root, project, f'v1.{version}.0', filename), 'w') as source_file:
+                                source_file.write(content)
+                        with open(os.path.join(root, project, 'version'), 'w') as version_file:
+                            version_file.write(f'v1.{version}.0')
+                    server.load()
+                    self.assertTrue(micropython_ota.ota_update_projects(f'http://127.0.0.1:{server.port}', ['core', 'drivers'])['updated'])
+        with open('lib/shared.py', 'r') as source_file:
+            self.assertEqual(source_file.read(), 'print("shared drivers")')
+        with open('projects.json', 'r') as projects_file:
+            self.assertIn('lib/shared.py', json.load(projects_file)['drivers']['manifest'])
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_downloads_from_peer_and_verifies_files(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind(('127.0.0.1', 0))
+            announce_port = probe.getsockname()[1]
+        with tempfile.TemporaryDirectory() as peer_dir:
+            with open(os.path.join(peer_dir, 'version'), 'w') as version_file:
+                version_file.write('v1.0.1')
+            with open(os.path.join(peer_dir, 'manifest.json'), 'w') as manifest_file:
+                manifest_file.write(urequests_mock.MockedUrls['http://example.org/sample/v1.0.1_manifest.json'][1])
+            with open(os.path.join(peer_dir, 'main.py'), 'w') as source_file:
+                source_file.write('print("Hello World")')
+            with open(os.path.join(peer_dir, 'library.py'), 'w') as source_file:
+                source_file.write('print("Tampered library")')
+            device = micropython_ota_peer.OtaPeer('sample', port=0, announce_port=announce_port, broadcast_address='127.255.255.255')
+            peer = micropython_ota_peer.OtaPeer('sample', port=0, announce_port=announce_port, broadcast_address='127.255.255.255', root=peer_dir)
+            stopped = threading.Event()
+
+            def serve():
+                while not stopped.is_set():
+                    peer.poll()
+                    stopped.wait(0.01)
+
+            thread = threading.Thread(target=serve)
+            thread.start()
+            try:
+                self.assertEqual(urequests_mock.LocalResponse(f'http://127.0.0.1:{peer.port}/sample/v1.0.1/version').status_code, 404)
+                with patch('urequests.get', side_effect=urequests_mock.mock_get_local) as urequests_call, patch('machine.reset'):
+                    result = micropython_ota.ota_update('http://example.org', 'sample', [], use_manifest=True, peer=device)
+            finally:
+                stopped.set()
+                thread.join()
+                peer.close()
+                device.close()
+        self.assertTrue(result['updated'])
+        self.assertEqual(result['files']['main.py']['mirror'], f'http://127.0.0.1:{peer.port}')
+        self.assertEqual(result['files']['library.py']['mirror'], 'http://example.org')
+        requested_urls = [call.args[0] for call in urequests_call.call_args_list]
+        self.assertNotIn('http://example.org/sample/v1.0.1_main.py', requested_urls)
+        with open('main.py', 'r') as source_file:
+            self.assertEqual(source_file.read(), 'print("Hello World")')
+        with open('library.py', 'r') as source_file:
+            self.assertEqual(source_file.read(), 'print("This is a library")')
+
+    def test_peer_sends_one_chunk_per_poll(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind(('127.0.0.1', 0))
+            announce_port = probe.getsockname()[1]
+        with tempfile.TemporaryDirectory() as peer_dir:
+            with open(os.path.join(peer_dir, 'version'), 'w') as version_file:
+                version_file.write('v1.0.1')
+            with open(os.path.join(peer_dir, 'manifest.json'), 'w') as manifest_file:
+                manifest_file.write(urequests_mock.MockedUrls['http://example.org/sample/v1.0.1_manifest.json'][1])
+            with open(os.path.join(peer_dir, 'main.py'), 'w') as source_file:
+                source_file.write('print("Hello World")')
+            peer = micropython_ota_peer.OtaPeer('sample', port=0, announce_port=announce_port, broadcast_address='127.0.0.1', root=peer_dir, chunk_size=8)
+            try:
+                with socket.create_connection(('127.0.0.1', peer.port), timeout=5) as client:
+                    client.sendall(b'GET /sample/v1.0.1/main.py HTTP/1.0\r\n\r\n')
+                    peer.poll()
+                    self.assertEqual(len(peer.transfers), 1)
+                    polls = 1
+                    while peer.transfers:
+                        peer.poll()
+                        polls += 1
+                    response = b''
+                    while True:
+                        data = client.recv(1024)
+                        if not data:
+                            break
+                        response += data
+            finally:
+                peer.close()
+        self.assertEqual(polls, 5)
+        self.assertEqual(response, b'HTTP/1.0 200 OK\r\nContent-Length: 20\r\n\r\nprint("Hello World")')
+
+    def test_peer_with_auth_requires_authorization(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind(('127.0.0.1', 0))
+            announce_port = probe.getsockname()[1]
+        with tempfile.TemporaryDirectory() as peer_dir:
+            with open(os.path.join(peer_dir, 'version'), 'w') as version_file:
+                version_file.write('v1.0.1')
+            with open(os.path.join(peer_dir, 'manifest.json'), 'w') as manifest_file:
+                manifest_file.write(urequests_mock.MockedUrls['http://example.org/sample/v1.0.1_manifest.json'][1])
+            with open(os.path.join(peer_dir, 'main.py'), 'w') as source_file:
+                source_file.write('print("Hello World")')
+            peer = micropython_ota_peer.OtaPeer('sample', port=0, announce_port=announce_port, broadcast_address='127.0.0.1', root=peer_dir,
+                                                auth='aGVsbG86d29ybGQ=')
+            responses = []
+            try:
+                for headers in [b'', b'Authorization: Basic d3Jvbmc6d3Jvbmc=\r\n', b'Authorization: Basic aGVsbG86d29ybGQ=\r\n']:
+                    with socket.create_connection(('127.0.0.1', peer.port), timeout=5) as client:
+                        client.sendall(b'GET /sample/v1.0.1/main.py HTTP/1.0\r\n' + headers + b'\r\n')
+                        peer.poll()
+                        while peer.transfers:
+                            peer.poll()
+                        response = b''
+                        while True:
+                            data = client.recv(1024)
+                            if not data:
+                                break
+                            response += data
+                        responses.append(response.split(b'\r\n')[0])
+            finally:
+                peer.close()
+        self.assertEqual(responses, [b'HTTP/1.0 401 Unauthorized', b'HTTP/1.0 401 Unauthorized', b'HTTP/1.0 200 OK'])
+
+    @patch(
+        'micropython_ota.check_version', micropython_ota_mock.mock_check_version_true
+    )
+    def test_ota_update_with_credentials_refuses_peer_without_auth(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind(('127.0.0.1', 0))
+            announce_port = probe.getsockname()[1]
+        peer = micropython_ota_peer.OtaPeer('sample', port=0, announce_port=announce_port, broadcast_address='127.0.0.1')
+        try:
+            with patch('urequests.get', side_effect=urequests_mock.mock_get) as urequests_call:
+                result = micropython_ota.ota_update('http://example.org', 'sample', [], user='hello', passwd='world', use_manifest=True, peer=peer)
+        finally:
+            peer.close()
+        urequests_call.assert_not_called()
+        self.assertFalse(result['updated'])
+        self.assertEqual(result['error'], 'Peers must require authentication when updating with credentials')
+
     def test_generate_auth_user_and_passwd_provided(self):
         auth = micropython_ota.generate_auth(user='hello', passwd='world')
         self.assertEqual('aGVsbG86d29ybGQ=', auth)
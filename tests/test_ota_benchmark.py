@@ -0,0 +1,23 @@
+import json
+import subprocess
+import sys
+import unittest
+
+
+class TestOtaBenchmark(unittest.TestCase):
+    def run_benchmark(self, *args) -> list:
+        process = subprocess.run([sys.executable, 'benchmarks/ota_benchmark.py', '--json', *args], capture_output=True, text=True, timeout=120)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return json.loads(process.stdout)
+
+    def test_update(self):
+        results = self.run_benchmark('update', '--files', '2', '--sizes', '512')
+        self.assertEqual([(result['compression'], result['auth']) for result in results], [(False, False), (False, True), (True, False), (True, True)])
+        self.assertTrue(all(result['updated'] for result in results))
+        self.assertTrue(all(result['flash_bytes'] >= 1024 for result in results))
+
+    def test_fleet_devices_keep_separate_state(self):
+        result, = self.run_benchmark('fleet', '--devices', '20', '--rounds', '2', '--concurrency', '8')
+        self.assertEqual(result['failures'], 0)
+        self.assertEqual(result['requests'], 40)
+        self.assertEqual(result['not_modified'], 20)
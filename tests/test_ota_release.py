@@ -0,0 +1,154 @@
+import gzip
+import json
+import random
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+
+sys.path.append('./ota_release')
+import ota_release
+
+
+class TestOtaRelease(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.release_dir = os.path.join(self.tmp_dir.name, 'v1.0.1')
+        os.makedirs(os.path.join(self.release_dir, 'lib'))
+        with open(os.path.join(self.release_dir, 'main.py'), 'w') as source_file:
+            source_file.write('print("Hello World")')
+        with open(os.path.join(self.release_dir, 'lib', 'library.py'), 'w') as source_file:
+            source_file.write('print("This is a library")')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_build_manifest(self):
+        manifest = ota_release.build_manifest(self.release_dir)
+        self.assertEqual(manifest, {'files': {
+            'lib/library.py': {'size': 26, 'sha256': '936c372dccc21e7dc3c27141f1678a1930c7939a4afdfb4e06d92e2357a00fae'},
+            'main.py': {'size': 20, 'sha256': 'eed9979879be4d18c16286d9439a2fc7d8744bb887d78bd2987e7fbadeb84a57'}
+        }})
+
+    def test_manifest_command(self):
+        output = os.path.join(self.tmp_dir.name, 'v1.0.1_manifest.json')
+        ota_release.main(['manifest', self.release_dir, output])
+        with open(output, 'r') as manifest_file:
+            self.assertEqual(json.load(manifest_file), ota_release.build_manifest(self.release_dir))
+
+    def write_fake_mpy_cross(self) -> str:
+        mpy_cross = os.path.join(self.tmp_dir.name, 'mpy-cross')
+        with open(mpy_cross, 'w') as script_file:
+            script_file.write(f'#!{sys.executable}\n'
+                              'import sys\n'
+                              'arguments = sys.argv[1:]\n'
+                              'with open(arguments[arguments.index("-o") + 1], "wb") as mpy_file:\n'
+                              '    mpy_file.write(b"M\\x06\\x00\\x1f\\xff\\r\\n" + " ".join(arguments[:-3]).encode())\n')
+        os.chmod(mpy_cross, 0o755)
+        return mpy_cross
+
+    def test_build_command(self):
+        output_dir = os.path.join(self.tmp_dir.name, 'server-root', 'sample')
+        ota_release.main(['build', self.release_dir, output_dir, 'v1.0.2', '--mpy-cross', self.write_fake_mpy_cross(), '--mpy-cross-arg=-march=xtensawin'])
+        self.assertEqual(ota_release.list_release_files(output_dir), ['v1.0.2_lib/library.mpy', 'v1.0.2_main.py', 'v1.0.2_manifest.json', 'version'])
+        with open(os.path.join(output_dir, 'v1.0.2_lib', 'library.mpy'), 'rb') as mpy_file:
+            self.assertEqual(mpy_file.read(), b'M\x06\x00\x1f\xff\r\n-march=xtensawin -s lib/library.py')
+        with open(os.path.join(output_dir, 'v1.0.2_main.py'), 'r') as source_file:
+            self.assertEqual(source_file.read(), 'print("Hello World")')
+        with open(os.path.join(output_dir, 'v1.0.2_manifest.json'), 'r') as manifest_file:
+            self.assertEqual(sorted(json.load(manifest_file)['files']), ['lib/library.mpy', 'main.py'])
+        with open(os.path.join(output_dir, 'version'), 'r') as version_file:
+            self.assertEqual(version_file.read(), 'v1.0.2')
+
+    def test_build_command_without_version_prefix_and_version_file(self):
+        output_dir = os.path.join(self.tmp_dir.name, 'server-root', 'sample')
+        ota_release.main(['build', self.release_dir, output_dir, 'v1.0.2', '--mpy-cross', self.write_fake_mpy_cross(), '--no-version-prefix',
+                          '--no-version-file', '--keep-source', 'lib/library.py'])
+        self.assertEqual(ota_release.list_release_files(output_dir), ['v1.0.2/lib/library.py', 'v1.0.2/main.mpy', 'v1.0.2/manifest.json'])
+
+    def test_index_command(self):
+        server_root = os.path.join(self.tmp_dir.name, 'server-root')
+        ota_release.main(['build', self.release_dir, os.path.join(server_root, 'sample'), 'v1.0.1', '--keep-source', 'lib/library.py',
+                          '--keep-source', 'main.py'])
+        os.makedirs(os.path.join(server_root, 'config'))
+        with open(os.path.join(server_root, 'config', 'version'), 'w') as version_file:
+            version_file.write('v2\nrollout=50\n')
+        ota_release.main(['index', server_root, '--manifests'])
+        with open(os.path.join(server_root, 'index.json'), 'r') as index_file:
+            self.assertEqual(json.load(index_file), {'projects': {
+                'config': {'version': 'v2', 'attributes': {'rollout': '50'}},
+                'sample': {'version': 'v1.0.1', 'files': ota_release.build_manifest(self.release_dir)['files']}
+            }})
+
+    def test_bundle_command_tar_gz(self):
+        output = os.path.join(self.tmp_dir.name, 'v1.0.1.tar.gz')
+        ota_release.main(['bundle', self.release_dir, output])
+        with open(output, 'rb') as bundle_file:
+            self.assertEqual(bundle_file.read(2), b'\x1f\x8b')
+        with tarfile.open(output, 'r:gz') as tar:
+            self.assertEqual(tar.getnames(), ['lib/library.py', 'main.py'])
+            self.assertEqual(tar.extractfile('main.py').read(), b'print("Hello World")')
+
+    def test_bundle_command_tar(self):
+        output = os.path.join(self.tmp_dir.name, 'v1.0.1.tar')
+        ota_release.main(['bundle', self.release_dir, output])
+        with tarfile.open(output, 'r:') as tar:
+            self.assertEqual(tar.getnames(), ['lib/library.py', 'main.py'])
+
+    def test_compress_command(self):
+        ota_release.main(['compress', self.release_dir])
+        ota_release.main(['compress', self.release_dir])
+        self.assertEqual(ota_release.list_release_files(self.release_dir), ['lib/library.py', 'lib/library.py.gz', 'main.py', 'main.py.gz'])
+        with gzip.open(os.path.join(self.release_dir, 'lib', 'library.py.gz'), 'rb') as compressed_file:
+            self.assertEqual(compressed_file.read(), b'print("This is a library")')
+
+    def test_checksums_command(self):
+        ota_release.main(['checksums', self.release_dir])
+        self.assertEqual(ota_release.list_release_files(self.release_dir), ['lib/library.py', 'lib/library.py.sha256', 'main.py', 'main.py.sha256'])
+        with open(os.path.join(self.release_dir, 'main.py.sha256'), 'r') as checksum_file:
+            self.assertEqual(checksum_file.read(), 'eed9979879be4d18c16286d9439a2fc7d8744bb887d78bd2987e7fbadeb84a57  main.py\n')
+
+    def test_checksums_and_compress_commands_skip_non_release_files(self):
+        project_dir = os.path.join(self.tmp_dir.name, 'sample')
+        ota_release.main(['build', self.release_dir, project_dir, 'v1.0.1', '--keep-source', 'main.py', '--keep-source', 'lib/library.py'])
+        ota_release.main(['bundle', self.release_dir, os.path.join(project_dir, 'v1.0.1.tar')])
+        ota_release.main(['bundle', self.release_dir, os.path.join(project_dir, 'v1.0.1.tar.gz')])
+        with open(os.path.join(project_dir, 'v1.0.1_main.py.v1.0.0.patch'), 'wb') as patch_file:
+            patch_file.write(ota_release.PATCH_MAGIC + b'E')
+        with open(os.path.join(project_dir, 'v1.0.1.tar.gz'), 'rb') as bundle_file:
+            bundle = bundle_file.read()
+        ota_release.main(['checksums', project_dir])
+        ota_release.main(['compress', project_dir])
+        self.assertEqual(ota_release.list_release_files(project_dir), [
+            'v1.0.1.tar', 'v1.0.1.tar.gz', 'v1.0.1_lib/library.py', 'v1.0.1_lib/library.py.gz', 'v1.0.1_lib/library.py.sha256', 'v1.0.1_main.py',
+            'v1.0.1_main.py.gz', 'v1.0.1_main.py.sha256', 'v1.0.1_main.py.v1.0.0.patch', 'v1.0.1_manifest.json', 'version'
+        ])
+        with open(os.path.join(project_dir, 'v1.0.1.tar.gz'), 'rb') as bundle_file:
+            self.assertEqual(bundle_file.read(), bundle)
+
+    def test_build_patch_roundtrip(self):
+        generator = random.Random(42)
+        old = bytes(generator.getrandbits(8) for _ in range(8192))
+        for new in [old, old[:4000] + b'changed' + old[4100:], old[4096:] + old[:4096], b'', b'new data only']:
+            patch = ota_release.build_patch(old, new)
+            self.assertEqual(ota_release.apply_patch(old, patch), new)
+        self.assertLess(len(ota_release.build_patch(old, old[:4000] + b'changed' + old[4100:])), 64)
+
+    def test_patch_command(self):
+        new_release_dir = os.path.join(self.tmp_dir.name, 'v1.0.2')
+        os.makedirs(os.path.join(new_release_dir, 'lib'))
+        with open(os.path.join(new_release_dir, 'main.py'), 'w') as source_file:
+            source_file.write('print("Hello World")')
+        with open(os.path.join(new_release_dir, 'lib', 'library.py'), 'w') as source_file:
+            source_file.write('print("This is a library")\n' * 20 + 'print("This is a new line")\n')
+        with open(os.path.join(self.release_dir, 'lib', 'library.py'), 'w') as source_file:
+            source_file.write('print("This is a library")\n' * 20)
+        output_dir = os.path.join(self.tmp_dir.name, 'sample')
+        ota_release.main(['patch', self.release_dir, new_release_dir, output_dir, 'v1.0.1', 'v1.0.2'])
+        self.assertEqual(ota_release.list_release_files(output_dir), ['v1.0.2_lib/library.py.v1.0.1.patch'])
+        ota_release.main(['patch', self.release_dir, new_release_dir, output_dir, 'v1.0.1', 'v1.0.2', '--no-version-prefix'])
+        with open(os.path.join(output_dir, 'v1.0.2', 'lib', 'library.py.v1.0.1.patch'), 'rb') as patch_file, \
+                open(os.path.join(self.release_dir, 'lib', 'library.py'), 'rb') as old_file:
+            self.assertEqual(ota_release.apply_patch(old_file.read(), patch_file.read()),
+                             ('print("This is a library")\n' * 20 + 'print("This is a new line")\n').encode())
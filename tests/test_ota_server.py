@@ -0,0 +1,103 @@
+import gzip
+import hashlib
+import http.client
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+
+sys.path.append('./ota_server')
+import ota_server
+
+
+class TestOtaServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        project_dir = os.path.join(self.tmp_dir.name, 'sample')
+        for version, content in [('v1.0.0', 'print("Hello World")\n' * 20), ('v1.0.1', 'print("Hello World")\n' * 20 + 'print("Bye")\n')]:
+            os.makedirs(os.path.join(project_dir, version, 'lib'))
+            with open(os.path.join(project_dir, version, 'main.py'), 'w') as source_file:
+                source_file.write(content)
+            with open(os.path.join(project_dir, version, 'lib', 'library.py'), 'w') as source_file:
+                source_file.write('print("This is a library")')
+        with open(os.path.join(project_dir, 'version'), 'w') as version_file:
+            version_file.write('v1.0.1')
+        self.main_py = ('print("Hello World")\n' * 20 + 'print("Bye")\n').encode()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def request(self, server, path, headers=None, method='GET') -> http.client.HTTPResponse:
+        connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+        connection.request(method, path, headers=headers or {})
+        response = connection.getresponse()
+        response.body = response.read()
+        connection.close()
+        return response
+
+    def test_serves_both_layouts(self):
+        with ota_server.OtaServer(self.tmp_dir.name, port=0) as server:
+            self.assertEqual(self.request(server, '/sample/version').body, b'v1.0.1')
+            self.assertEqual(self.request(server, '/sample/v1.0.1_main.py').body, self.main_py)
+            self.assertEqual(self.request(server, '/sample/v1.0.1/main.py').body, self.main_py)
+            self.assertEqual(self.request(server, '/sample/v1.0.1_lib/library.py').body, b'print("This is a library")')
+            self.assertEqual(self.request(server, '/sample/v1.0.2_main.py').status, 404)
+            self.assertEqual(self.request(server, '/sample/../../etc/passwd').status, 404)
+
+    def test_serves_precomputed_variants(self):
+        with ota_server.OtaServer(self.tmp_dir.name, port=0) as server:
+            manifest = json.loads(self.request(server, '/sample/v1.0.1_manifest.json').body)
+            self.assertEqual(manifest['files']['main.py'], {'size': len(self.main_py), 'sha256': hashlib.sha256(self.main_py).hexdigest()})
+            self.assertEqual(self.request(server, '/sample/v1.0.1/main.py.sha256').body, f'{hashlib.sha256(self.main_py).hexdigest()}  main.py\n'.encode())
+            self.assertEqual(gzip.decompress(self.request(server, '/sample/v1.0.1_main.py.gz').body), self.main_py)
+            with tarfile.open(fileobj=io.BytesIO(self.request(server, '/sample/v1.0.1.tar.gz').body)) as tar:
+                self.assertEqual(sorted(tar.getnames()), ['lib/library.py', 'main.py'])
+            patch = self.request(server, '/sample/v1.0.1_main.py.v1.0.0.patch').body
+            self.assertEqual(ota_server.ota_release.apply_patch(('print("Hello World")\n' * 20).encode(), patch), self.main_py)
+            self.assertEqual(self.request(server, '/sample/v1.0.1_lib/library.py.v1.0.0.patch').status, 404)
+
+    def test_serves_index(self):
+        with ota_server.OtaServer(self.tmp_dir.name, port=0) as server:
+            index = json.loads(self.request(server, '/index.json').body)
+        self.assertEqual(index['projects']['sample']['version'], 'v1.0.1')
+        self.assertEqual(sorted(index['projects']['sample']['files']), ['lib/library.py', 'main.py'])
+
+    def test_conditional_and_range_requests(self):
+        with ota_server.OtaServer(self.tmp_dir.name, port=0) as server:
+            etag = self.request(server, '/sample/version').getheader('ETag')
+            self.assertEqual(self.request(server, '/sample/version', {'If-None-Match': etag}).status, 304)
+            response = self.request(server, '/sample/v1.0.1_main.py', {'Range': 'bytes=400-'})
+            self.assertEqual(response.status, 206)
+            self.assertEqual(response.body, self.main_py[400:])
+            self.assertEqual(response.getheader('Content-Range'), f'bytes 400-{len(self.main_py) - 1}/{len(self.main_py)}')
+            self.assertEqual(self.request(server, '/sample/v1.0.1_main.py', {'Range': 'bytes=0-9'}).body, self.main_py[:10])
+            self.assertEqual(self.request(server, '/sample/v1.0.1_main.py', {'Range': f'bytes={len(self.main_py)}-'}).status, 416)
+
+    def test_basic_authentication_and_max_age(self):
+        with ota_server.OtaServer(self.tmp_dir.name, port=0, user='hello', passwd='world', max_age=120) as server:
+            self.assertEqual(self.request(server, '/sample/version').status, 401)
+            response = self.request(server, '/sample/version', {'Authorization': 'Basic aGVsbG86d29ybGQ='})
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.getheader('Cache-Control'), 'max-age=120')
+
+    def test_keeps_connections_alive(self):
+        with ota_server.OtaServer(self.tmp_dir.name, port=0) as server:
+            connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+            for path in ['/sample/version', '/sample/v1.0.1_main.py', '/sample/v1.0.1_lib/library.py']:
+                connection.request('GET', path)
+                connection.getresponse().read()
+            connection.close()
+        self.assertEqual(server.connections, 1)
+        self.assertEqual([request[1] for request in server.requests], ['/sample/version', '/sample/v1.0.1_main.py', '/sample/v1.0.1_lib/library.py'])
+
+    def test_keeps_counters_and_bounded_request_log(self):
+        with ota_server.OtaServer(self.tmp_dir.name, port=0, request_log_size=2) as server:
+            etag = self.request(server, '/sample/version').getheader('ETag')
+            self.request(server, '/sample/version', {'If-None-Match': etag})
+            self.request(server, '/sample/v1.0.2_main.py')
+        self.assertEqual(server.request_count, 3)
+        self.assertEqual(server.statuses, {200: 1, 304: 1, 404: 1})
+        self.assertEqual([request[1] for request in server.requests], ['/sample/version', '/sample/v1.0.2_main.py'])